@@ -0,0 +1,124 @@
+import time, threading, asyncio
+from collections import OrderedDict
+import numpy as np
+from telemetry import telemetry
+
+class SemanticAnswerCache:
+    """ Cache of the answers of the 'search_internal_database' tool, looked up by meaning.
+    The query is embedded and compared (cosine similarity) with the previously answered queries:
+    above 'similarity_threshold' the stored answer is returned, without retrieval nor LLM call.
+    Entries expire after 'ttl_seconds', the least recently used are evicted beyond 'max_entries',
+    and the whole cache is dropped when 'version_getter()' (the version of the collection) changes;
+    the async methods read it with 'aversion_getter' (in a worker thread without it). """
+
+    def __init__(self, embedding_model, similarity_threshold: float = 0.95, max_entries: int = 512,
+                 ttl_seconds: float = 24 * 3600, version_getter = None, aversion_getter = None):
+        self.embedding_model = embedding_model
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.version_getter = version_getter
+        self.aversion_getter = aversion_getter
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # normalized query -> (unit vector, answer, creation time)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    def _embed(self, query: str) -> np.ndarray:
+        # the raw query is embedded: with a cached embedding model, the retriever gets it for free
+        return self._unit_vector(self.embedding_model.embed_query(query))
+
+    async def _aembed(self, query: str) -> np.ndarray:
+        return self._unit_vector(await self.embedding_model.aembed_query(query))
+
+    @staticmethod
+    def _unit_vector(vector: list) -> np.ndarray:
+        vector = np.asarray(vector, dtype = np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _read_version(self):
+        # outside the lock: it may need a round trip to Qdrant
+        return self.version_getter() if self.version_getter is not None else None
+
+    async def _aread_version(self):
+        if self.aversion_getter is not None:
+            return await self.aversion_getter()
+        if self.version_getter is not None:
+            return await asyncio.to_thread(self.version_getter)
+        return None
+
+    def _check_version(self, version):
+        # called with the lock held
+        if version != self.version:
+            self._entries.clear()
+            self.version = version
+
+    def _drop_expired(self):
+        # called with the lock held
+        now = time.time()
+        expired = [key for key, (_, _, created_at) in self._entries.items() if now - created_at > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+
+    def lookup(self, query: str) -> tuple:
+        """ (version of the collection, stored answer of the most similar query above the threshold or None):
+        the version is handed back to 'store', so an answer built before a change of the documents is not kept """
+        return self._lookup_vector(self._embed(query), self._read_version())
+
+    async def alookup(self, query: str) -> tuple:
+        vector = await self._aembed(query)
+        return self._lookup_vector(vector, await self._aread_version())
+
+    def _lookup_vector(self, vector: np.ndarray, current_version) -> tuple:
+        with self._lock:
+            self._check_version(current_version)
+            version = self.version
+            self._drop_expired()
+            if self._entries:
+                keys = list(self._entries.keys())
+                similarities = np.vstack([self._entries[key][0] for key in keys]) @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    self._entries.move_to_end(keys[best])
+                    self.hits += 1
+                    telemetry.cache_result("answer", hit = True)
+                    return version, self._entries[keys[best]][1]
+            self.misses += 1
+            telemetry.cache_result("answer", hit = False)
+            return version, None
+
+    def store(self, query: str, answer: str, version = None):
+        """ Store the answer, unless the collection changed since the 'lookup' that returned 'version' """
+        self._store_vector(query, self._embed(query), answer, version, self._read_version())
+
+    async def astore(self, query: str, answer: str, version = None):
+        vector = await self._aembed(query)
+        self._store_vector(query, vector, answer, version, await self._aread_version())
+
+    def _store_vector(self, query: str, vector: np.ndarray, answer: str, version, current_version):
+        with self._lock:
+            self._check_version(current_version)
+            if version != self.version: # the documents changed while the answer was built
+                return
+            key = self.normalize_query(query)
+            self._entries.pop(key, None)
+            self._entries[key] = (vector, answer, time.time())
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last = False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries)}
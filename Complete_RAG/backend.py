@@ -45,13 +45,29 @@ from langchain_qdrant import QdrantVectorStore
 from langchain_core.documents import Document
 
 import streamlit as st
-from qdrant_admin import QdrantAdmin
+from qdrant_admin import QdrantAdmin, LAYOUT_PROFILES
+from ingestion import IngestionEngine, IngestionStats
+from embedding_cache import CachedEmbeddings
+from embeddings import get_embedding_provider
+from answer_cache import SemanticAnswerCache
+from retrieval_cache import CachedRetriever
+from retrieval import QdrantRetriever
+from short_memory import ShortMemory, SupernotesState
+from summary_memory import SummaryMemory
+from user_memory import UserMemory, open_user_store
+from telemetry import telemetry, LLMTelemetryCallback
+from checkpoint_store import open_checkpointer, checkpoint_serializer, aconnect as aconnect_checkpoints, maintain as maintain_checkpoints
+from langchain_core.runnables import RunnableLambda, RunnableConfig
 
 from langchain_community.tools import DuckDuckGoSearchRun
 from langgraph.prebuilt import ToolNode, tools_condition
 from langchain_core.tools import tool
 
-from my_tools import get_my_tools
+from my_tools import get_my_tools, get_memory_tool
+from context_assembly import ContextAssembler
+from reranker import get_reranker
+from router import QueryRouter
+import uuid
 
 from IPython.display import Image, display
 
@@ -61,30 +77,100 @@ from langchain_core.messages import trim_messages
 ################ HUPERPARAMETERS ################
 #################################################
 
-VECTOR_SIZE = 1536 # default of 'text-embedding-3-small'
 TEMPERATURE = 0.2
 QDRANT_URL = "http://localhost:6333"
 USER_NAME = "Alessio"
 SUBJECT = "Physics"
-QDRANT_COLLECTION_NAME = f"{USER_NAME}_collection_{SUBJECT}"
+QDRANT_COLLECTION_NAME = f"{USER_NAME}_collection_{SUBJECT}" # collection of the default embedding space, the others append their id (see 'collection_name')
+QDRANT_LAYOUT = "default" # one among LAYOUT_PROFILES: "default", "scalar", "binary"
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
 TOP_K = 5
+RERANKER = os.getenv("RERANKER", "bm25") # "bm25" (lexical, pure Python), "cross-encoder" (local CPU model) or "none"
+RETRIEVAL_SCORE_THRESHOLD = float(os.getenv("RETRIEVAL_SCORE_THRESHOLD", 0.2)) # min cosine similarity of a chunk, it depends on the embedding model
+RETRIEVAL_RELATIVE_CUTOFF = 0.6 # chunks below this fraction of the best similarity are dropped (adaptive k)
+RERANK_FETCH_K = 20 # candidates fetched from Qdrant and rescored
+RERANK_TOP_N = 3 # chunks kept after the rescoring (TOP_K is used without reranker)
+RERANK_BATCH_SIZE = 16
+RERANK_BUDGET_MS = 150 # after this time the remaining candidates are not rescored
+CONTEXT_TOKEN_BUDGET = 1500 # tokens of retrieved context passed to the generation, after stitching the overlaps
+CONTEXT_MMR_LAMBDA = 0.7 # 1: only relevance, 0: only diversity of the selected spans
 SHORT_MEMORY_TOKENS = 4000
+SHORT_MEMORY_MODE = "trim" # "trim": the last SHORT_MEMORY_TOKENS of history, "summary": running summary + recent window
+SUMMARY_RECENT_TOKENS = 1000 # raw history sent with the summary, older messages are folded into it in background
+SUMMARY_MAX_WORDS = 250
+SESSION_HISTORY_PATH = "session_history.db"
+CHECKPOINTS_PER_THREAD = 20 # older checkpoints are deleted at startup (or with checkpoint_store.py)
+SESSION_TTL_DAYS = 30 # "Clean chat" sessions without activity for longer are deleted
+USER_MEMORY_PATH = "user_memory.db"
+USER_MEMORY_MAX_ITEMS = 100 # memories kept per user, the least recently updated are deleted
+USER_MEMORY_RECALL_K = 5 # memories added to the team leader prompt
+TELEMETRY_JSONL_PATH = None # es "telemetry.jsonl": one JSON record per span
+TELEMETRY_PROMETHEUS_PORT = None # es 9464: Prometheus metrics on http://127.0.0.1:9464/metrics
+HISTORY_PAGE_TURNS = 10 # chat turns rendered at once by the frontend, older ones with "Load earlier messages"
+EMBEDDING_BATCH_SIZE = 64 # chunks per embedding request
+EMBEDDING_MAX_IN_FLIGHT = 4 # concurrent embedding requests
+INGESTION_MAX_RETRIES = 5 # per batch, with exponential backoff
+INGESTION_WINDOW_SIZE = 256 # chunks handed at once from the loader to the embedding stage
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai") # "openai", "local" (CPU) or "hashing" (offline, for tests)
+EMBEDDING_CACHE_PATH = "embedding_cache.db"
+EMBEDDING_CACHE_MAX_MB = 512
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_THRESHOLD = 0.95 # cosine similarity between queries to reuse an answer
+ANSWER_CACHE_MAX_ENTRIES = 512
+ANSWER_CACHE_TTL_SECONDS = 24 * 3600
+RETRIEVAL_CACHE_MAX_ENTRIES = 256
+SPECULATIVE_WEB_SEARCH = False # start the web search together with the internal retrieval
+SPECULATIVE_SCORE_THRESHOLD = 0.35 # below this best similarity, the web results are used instead
+ROUTER_ENABLED = False # local pre-router: templated greetings and refusals, clear questions straight to the retrieval
+ROUTER_DOMAIN_EXAMPLES = [SUBJECT, f"exam material and lecture notes of {SUBJECT}", "Physics and Mathematics",
+                          "equations, theorems, derivations and exercises", "economics and finance concepts"]
+TOOL_MODE = "answer" # "answer": the tools write an answer (2 LLM calls per question), "context": they return the sources
 
 ###################################################
 ################ BACKEND STRUCTURE ################
 ###################################################
 
+DEFAULT_VECTOR_SPACE = "openai-text-embedding-3-small-1536" # the space of the collections created before the pluggable embeddings
+
+def collection_name(embedding_provider) -> str:
+    """ One collection per embedding space: switching provider, model or dimensions starts an empty
+    collection instead of mixing vectors that are not comparable (es local MiniLM and hashing, both 384).
+    The default OpenAI space keeps QDRANT_COLLECTION_NAME, so the existing knowledge bases are still found. """
+    if embedding_provider.vector_space == DEFAULT_VECTOR_SPACE:
+        return QDRANT_COLLECTION_NAME
+    return f"{QDRANT_COLLECTION_NAME}__{embedding_provider.vector_space}"
+
+def user_memory_path(embedding_provider) -> str:
+    """ The user memories are embedded too: one store per embedding space (a sqlite-vec index has fixed dimensions) """
+    if embedding_provider.vector_space == DEFAULT_VECTOR_SPACE:
+        return USER_MEMORY_PATH
+    root, extension = os.path.splitext(USER_MEMORY_PATH)
+    return f"{root}__{embedding_provider.vector_space}{extension}"
+
 @st.cache_resource
 def backend_setup():
 
+    # spans and histograms of every stage, exported offline
+    telemetry.jsonl_path = TELEMETRY_JSONL_PATH
+    if TELEMETRY_PROMETHEUS_PORT:
+        telemetry.serve_prometheus(TELEMETRY_PROMETHEUS_PORT)
+
     ##############################################
     ################ MODELS SETUP ################
     ##############################################
 
-    embedding_model = OpenAIEmbeddings(model = "text-embedding-3-small",
-                                    dimensions = VECTOR_SIZE)                  
+    # the backend is chosen with EMBEDDING_PROVIDER (and EMBEDDING_MODEL, EMBEDDING_DIMENSIONS) in the environment,
+    # the size of the Qdrant vectors follows the model
+    embedding_provider = get_embedding_provider(provider_name = EMBEDDING_PROVIDER, batch_size = EMBEDDING_BATCH_SIZE)
+    vector_size = embedding_provider.dimensions
+    # every embedding (chunks and queries) goes through the persistent cache
+    embedding_model = CachedEmbeddings(
+                        embedding_provider,
+                        path = EMBEDDING_CACHE_PATH,
+                        model_name = embedding_provider.model_name,
+                        dimensions = vector_size,
+                        max_size_mb = EMBEDDING_CACHE_MAX_MB)
     llm = ChatOpenAI(model_name = "gpt-4o-mini",
                     temperature = TEMPERATURE,
                     max_tokens = 2048)
@@ -94,17 +180,60 @@ def backend_setup():
     #################################################
 
     qdrant_admin = QdrantAdmin(url = QDRANT_URL, 
-                        collection_name = QDRANT_COLLECTION_NAME, 
-                        vector_size = VECTOR_SIZE)
-    qdrant_admin.create_collection() # uses default parameters
+                        collection_name = collection_name(embedding_provider), 
+                        vector_size = vector_size,
+                        layout = LAYOUT_PROFILES[QDRANT_LAYOUT])
+    qdrant_admin.create_collection() # the layout of an existing collection is changed with 'migrate_collection'
+    # collections ingested when PDF pages were numbers: 'qdrant_admin.normalize_pages()' once, or 'migrate_collection'
+
+    ########################################
+    ################ MEMORY ################
+    ########################################
+
+    # session memory
+    # ram_memory_db = MemorySaver()
+    # WAL and tuned pragmas, one serialized writer shared by the sessions (see 'checkpoint_store.py')
+    persistent_memory_db = open_checkpointer(SESSION_HISTORY_PATH)
+    # at startup: old checkpoints are compacted and the abandoned "Clean chat" sessions are purged
+    maintain_checkpoints(persistent_memory_db.conn, CHECKPOINTS_PER_THREAD, SESSION_TTL_DAYS * 24 * 3600)
+
+    # user memory: durable and shared by the processes, the memories are searched by meaning
+    user_memory_db = open_user_store(user_memory_path(embedding_provider), embedding_model, vector_size)
+
+    qdrant_db, financial_assistant_team = build_backend(llm, embedding_model, qdrant_admin, persistent_memory_db, user_memory_db)
+
+    return qdrant_admin, qdrant_db, financial_assistant_team
+
+def build_retriever(embedding_model, qdrant_admin: QdrantAdmin) -> CachedRetriever:
+    """ Retriever of the tools: vector search, reranking, score threshold and cache (also timed by 'benchmark.py') """
+    # similarity search with a sync and an async (AsyncQdrantClient) path,
+    # the search params of the layout enable the rescoring of quantized vectors;
+    # a wider candidate set is then rescored on CPU and only the best chunks reach the prompt
+    reranker = get_reranker(RERANKER, batch_size = RERANK_BATCH_SIZE, budget_seconds = RERANK_BUDGET_MS / 1000)
+    retriever = QdrantRetriever(
+                    qdrant_admin = qdrant_admin,
+                    embedding_model = embedding_model,
+                    k = RERANK_TOP_N if reranker is not None else TOP_K,
+                    reranker = reranker,
+                    fetch_k = RERANK_FETCH_K,
+                    score_threshold = RETRIEVAL_SCORE_THRESHOLD,
+                    relative_score_cutoff = RETRIEVAL_RELATIVE_CUTOFF,
+                    search_params = qdrant_admin.layout.search_params())
+    # repeated retrievals skip embedding and search, until the collection version changes
+    return CachedRetriever(retriever = retriever,
+                           version_getter = qdrant_admin.collection_version,
+                           aversion_getter = qdrant_admin.acollection_version,
+                           max_entries = RETRIEVAL_CACHE_MAX_ENTRIES)
+
+def build_backend(llm, embedding_model, qdrant_admin: QdrantAdmin, checkpointer, user_memory_db = None):
+    """ Vector store, retriever, tools and compiled graph around the given models, Qdrant collection
+    and checkpointer. 'backend_setup' passes the production ones, 'benchmark.py' fakes and ':memory:'. """
 
     qdrant_db = QdrantVectorStore(
                 client = qdrant_admin.client,
-                collection_name = QDRANT_COLLECTION_NAME,
+                collection_name = qdrant_admin.collection_name,
                 embedding = embedding_model)
-    retriever = qdrant_db.as_retriever(
-                    search_kwargs = {"k": TOP_K},
-                    search_type = "similarity")
+    retriever = build_retriever(embedding_model, qdrant_admin)
 
     #################################################################
     ################ DOCUMENT CHUNKING and EMBEDDING ################
@@ -116,9 +245,39 @@ def backend_setup():
     ################ TOOLS: TEAM MEMBERS ################
     #####################################################
 
-    search_internal_database, search_internet_duckduckgo = get_my_tools(llm, retriever, SUBJECT)
+    # answers of the internal database, reused for semantically equivalent queries until the documents change
+    answer_cache = None
+    if ANSWER_CACHE_ENABLED:
+        answer_cache = SemanticAnswerCache(embedding_model,
+                                           similarity_threshold = ANSWER_CACHE_THRESHOLD,
+                                           max_entries = ANSWER_CACHE_MAX_ENTRIES,
+                                           ttl_seconds = ANSWER_CACHE_TTL_SECONDS,
+                                           version_getter = qdrant_admin.collection_version,
+                                           aversion_getter = qdrant_admin.acollection_version)
+
+    # neighboring chunks of a page share CHUNK_OVERLAP characters: they are stitched and deduplicated
+    context_assembler = ContextAssembler(token_counter = llm,
+                                         max_tokens = CONTEXT_TOKEN_BUDGET,
+                                         mmr_lambda = CONTEXT_MMR_LAMBDA,
+                                         chunk_overlap = CHUNK_OVERLAP)
+
+    search_internal_database, search_internet_duckduckgo = get_my_tools(
+                llm, retriever, SUBJECT, answer_cache,
+                speculative_web_threshold = SPECULATIVE_SCORE_THRESHOLD if SPECULATIVE_WEB_SEARCH else None,
+                mode = TOOL_MODE,
+                context_assembler = context_assembler)
 
-    all_tools = [search_internal_database, search_internet_duckduckgo]
+    #############################################
+    ################ USER MEMORY ################
+    #############################################
+
+    if user_memory_db is None:
+        from langgraph.store.memory import InMemoryStore
+        user_memory_db = InMemoryStore()
+    user_memory = UserMemory(user_memory_db, embedding_model, max_memories = USER_MEMORY_MAX_ITEMS)
+    save_user_preference = get_memory_tool(user_memory, USER_NAME)
+
+    all_tools = [search_internal_database, search_internet_duckduckgo, save_user_preference]
     llm_with_tools = llm.bind_tools(all_tools)
 
     #############################################
@@ -135,67 +294,160 @@ def backend_setup():
     - GREETINGS/THANKS: If {USER_NAME} greets or thanks you, wish her a great day and tell {USER_NAME} is the best.
     - OUTPUT STYLE: Your final response to {USER_NAME} must be a maximum of 10 sentences, maintaining a professional and supportive tone.
     - LANGUAGE: Use for the final answer the same language as in the user query.
-    - USER PREFERENCES: You can save user preferences, if useful.
+    - USER PREFERENCES: When {USER_NAME} states a lasting preference (language, level of detail, style, topics of interest), save it with the 'save_user_preference' tool. The preferences saved in past conversations are listed after these instructions: follow them.
     - REFERENCES: Always cite the source of your information (document name and page number, or url) in the final answer.
 
     WORKFLOW & DELEGATION LOGIC:
     - PHASE 1 (Core Domain): If the question is about {SUBJECT} or strictly conntected topics (es Physics and Mathematics), or exam material, ALWAYS delegate the query to the 'search_internal_database' tool. Use its output to craft your final response.
     - PHASE 2 (Out of Bounds): If the question is NOT related to {SUBJECT} (e.g., recipes, sports), politely apologize and state that you are not an expert in that field. DO NOT use any tools for these topics.
-    - PHASE 3 (Fallback): If you delegated a {SUBJECT} question to the 'search_internal_database' and it returns a poor or inconsistent answer, this indicates the internal database is empty. In this specific case, you MUST delegate the search to the 'search_internet_duckduckgo'."""
+    - PHASE 3 (Fallback): If you delegated a {SUBJECT} question to the 'search_internal_database' and it returns NO_RELEVANT_DATA (or a poor or inconsistent answer), the internal database has nothing on the topic. In this specific case, you MUST delegate the search to the 'search_internet_duckduckgo'. If the 'search_internal_database' answer already comes from a web search, do NOT search the web again.
+    - PARALLEL CALLS: If the question contains several independent sub-questions, call the tools for all of them in the same turn: they are executed concurrently."""
+
+    if TOOL_MODE == "context":
+        TEAM_LEADER_PROMPT += f"""
+    - TOOL OUTPUTS: The tools return raw excerpts, tagged as "[n] document name, p. page: text" (or web results with their url). Answer ONLY from them, citing document name and page (or url) for every claim."""
 
     sys_msg = SystemMessage(content = TEAM_LEADER_PROMPT)
 
-    trimmer = trim_messages(
-        max_tokens = SHORT_MEMORY_TOKENS, 
-        strategy = "last", 
-        token_counter = llm, 
-        include_system = False)
+    # the token count of every message is computed once and saved in the state (see 'SupernotesState'),
+    # a turn only tokenizes the new messages instead of the whole thread
+    short_memory = ShortMemory(token_counter = llm, max_tokens = SHORT_MEMORY_TOKENS)
+    # in summary mode the prompt carries a running summary and only the last SUMMARY_RECENT_TOKENS of history
+    summary_memory = None
+    if SHORT_MEMORY_MODE == "summary":
+        summary_memory = SummaryMemory(llm, window_memory = short_memory,
+                                       recent_memory = ShortMemory(token_counter = llm, max_tokens = SUMMARY_RECENT_TOKENS),
+                                       user_name = USER_NAME, subject = SUBJECT, max_words = SUMMARY_MAX_WORDS)
+
+    def last_user_query(state: SupernotesState) -> str:
+        for msg in reversed(state["messages"]):
+            if isinstance(msg, HumanMessage):
+                return msg.content if isinstance(msg.content, str) else str(msg.content)
+        return ""
+
+    def messages_for_team_leader(state: SupernotesState, memories: list, config: dict):
+        summary = ""
+        with telemetry.span("trimmer"):
+            if summary_memory is None:
+                short_session_history, new_token_counts, trim_seconds = short_memory.window(state["messages"], state.get("token_counts") or {})
+                update = {"token_counts": new_token_counts, "trim_seconds": trim_seconds}
+            else:
+                summary, short_session_history, update = summary_memory.prepare(
+                            config["configurable"]["thread_id"], state["messages"], state.get("token_counts") or {},
+                            state.get("summary", ""), state.get("summarized_until"))
+        system_messages = [sys_msg]
+        if memories:
+            system_messages.append(SystemMessage(content = f"KNOWN PREFERENCES OF {USER_NAME}:\n" + "\n".join(f"- {memory}" for memory in memories)))
+        if summary:
+            system_messages.append(SystemMessage(content = f"SUMMARY OF THE EARLIER CONVERSATION WITH {USER_NAME}:\n{summary}"))
+        return system_messages + short_session_history, update
+
+    # time to first token, latency and tokens in/out of the team leader calls: the handler is bound to the model,
+    # the callbacks of the graph (es the token stream of stream_mode="messages") still come with the node config
+    team_leader_llm = llm_with_tools.with_config(callbacks = [LLMTelemetryCallback(telemetry, "team_leader")])
 
     TEAM_LEADER_NODE_NAME = "team_leader_node"
-    def team_leader_node(state: MessagesState):
-        short_session_history = trimmer.invoke(state["messages"])
-        # the while is needed to stop generation
-        while short_session_history and isinstance(short_session_history[0], ToolMessage):
-            short_session_history.pop(0)
+    @telemetry.traced("team_leader")
+    def team_leader_node(state: SupernotesState, config: RunnableConfig):
+        # long-term memory: one semantic search in the namespace of the user
+        with telemetry.span("memory_recall"):
+            memories = user_memory.recall(USER_NAME, last_user_query(state), limit = USER_MEMORY_RECALL_K)
+        messages, update = messages_for_team_leader(state, memories, config)
+        with telemetry.span("team_leader_llm"):
+            response = team_leader_llm.invoke(messages, config = config)
+        return {"messages": [response], **update}
+
+    @telemetry.traced("team_leader")
+    async def ateam_leader_node(state: SupernotesState, config: RunnableConfig):
+        with telemetry.span("memory_recall"):
+            memories = await user_memory.arecall(USER_NAME, last_user_query(state), limit = USER_MEMORY_RECALL_K)
+        messages, update = messages_for_team_leader(state, memories, config)
+        with telemetry.span("team_leader_llm"):
+            response = await team_leader_llm.ainvoke(messages, config = config)
+        return {"messages": [response], **update}
 
-        messages_to_send = [sys_msg] + short_session_history
-        return {"messages": [llm_with_tools.invoke(messages_to_send)]}
 
     ########################################
-    ################ MEMORY ################
+    ################ ROUTER ################
     ########################################
 
-    # session memory
-    # ram_memory_db = MemorySaver()
-    import sqlite3
-    from langgraph.checkpoint.sqlite import SqliteSaver
-    conn = sqlite3.connect("session_history.db", check_same_thread = False)
-    persistent_memory_db = SqliteSaver(conn)
-
-    # user memory
-    from langgraph.store.memory import InMemoryStore
-    user_memory_db = InMemoryStore()
+    # greetings, off-topic questions and clear domain questions skip the tool-decision LLM call
+    router = QueryRouter(embedding_model, ROUTER_DOMAIN_EXAMPLES, names = [USER_NAME, "Supernotes"])
+    GREETING_REPLIES = {"en": f"Hi {USER_NAME}! I am Supernotes, your assistant for {SUBJECT}. Have a great day: you are the best!",
+                        "it": f"Ciao {USER_NAME}! Sono Supernotes, il tuo assistente per {SUBJECT}. Ti auguro una splendida giornata: sei il migliore!"}
+    REFUSAL_REPLIES = {"en": f"I'm sorry {USER_NAME}, I am not an expert in that field: I can only help you with {SUBJECT} and related topics.",
+                       "it": f"Mi dispiace {USER_NAME}, non sono esperto in questo campo: posso aiutarti solo con {SUBJECT} e gli argomenti collegati."}
+
+    def routed_messages(state: SupernotesState, route: str) -> dict:
+        query = last_user_query(state)
+        telemetry.increment("router_routes_total", route = route)
+        if route == "greeting":
+            return {"messages": [AIMessage(content = GREETING_REPLIES[router.greeting_language(query)])]}
+        if route == "refuse":
+            return {"messages": [AIMessage(content = REFUSAL_REPLIES[router.message_language(query)])]}
+        if route == "retrieve":
+            tool_call = {"name": search_internal_database.name, "args": {"query": query}, "id": f"router_{uuid.uuid4().hex[:12]}"}
+            return {"messages": [AIMessage(content = "", tool_calls = [tool_call])]}
+        return {} # slow path: the team leader decides
+
+    def router_node(state: SupernotesState):
+        with telemetry.span("router") as span:
+            span["route"], span["margin"] = router.route(last_user_query(state))
+        return routed_messages(state, span["route"])
+
+    async def arouter_node(state: SupernotesState):
+        with telemetry.span("router") as span:
+            span["route"], span["margin"] = await router.aroute(last_user_query(state))
+        return routed_messages(state, span["route"])
+
+    def after_router(state: SupernotesState) -> str:
+        last_message = state["messages"][-1]
+        if isinstance(last_message, AIMessage):
+            return "Team_Members" if last_message.tool_calls else END
+        return "Supernotes"
 
     ###########################################
     ################ WORKFLOW  ################
     ###########################################
 
-    workflow = StateGraph(MessagesState)
+    workflow = StateGraph(SupernotesState)
 
     tools_node = ToolNode(tools = all_tools)
 
-    workflow.add_node("Supernotes", team_leader_node)
+    # the same graph runs both with 'stream' (frontend) and with 'astream' (see 'abackend_setup')
+    workflow.add_node("Supernotes", RunnableLambda(team_leader_node, afunc = ateam_leader_node))
     workflow.add_node("Team_Members", tools_node)
 
-    workflow.add_edge(START, "Supernotes")
+    if ROUTER_ENABLED:
+        workflow.add_node("Router", RunnableLambda(router_node, afunc = arouter_node))
+        workflow.add_edge(START, "Router")
+        workflow.add_conditional_edges("Router", after_router, {"Supernotes": "Supernotes", "Team_Members": "Team_Members", END: END})
+    else:
+        workflow.add_edge(START, "Supernotes")
     workflow.add_conditional_edges("Supernotes", tools_condition, {"tools": "Team_Members", END: END})
     workflow.add_edge("Team_Members", "Supernotes")
 
     financial_assistant_team = workflow.compile(
-                checkpointer = persistent_memory_db, 
+                checkpointer = checkpointer, 
                 store = user_memory_db)
     
-    return qdrant_admin, qdrant_db, financial_assistant_team
+    return qdrant_db, financial_assistant_team
+
+async def abackend_setup():
+    """ Async twin of 'backend_setup', to be awaited inside the event loop that serves the sessions
+    (the async checkpointer is bound to it). The compiled graph is driven with 'ainvoke'/'astream':
+    LLM, embeddings, Qdrant and checkpoints are all awaited, so one process can serve many
+    concurrent sessions without a thread per request. """
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+    qdrant_admin, qdrant_db, financial_assistant_team = backend_setup()
+    async_memory_db = AsyncSqliteSaver(await aconnect_checkpoints(SESSION_HISTORY_PATH),
+                                       serde = checkpoint_serializer(SESSION_HISTORY_PATH))
+    async_financial_assistant_team = financial_assistant_team.builder.compile(
+                checkpointer = async_memory_db,
+                store = financial_assistant_team.store)
+
+    return qdrant_admin, qdrant_db, async_financial_assistant_team
 
 #################################################################
 ################ DOCUMENT CHUNKING and EMBEDDING ################
@@ -208,7 +460,9 @@ def document_controller(file_path: str) -> bool:
 
     return extension in admissible_extensions
 
-def document_ingestor(file_path: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> list:
+def document_stream(file_path: str, chunk_size: int = 1000, chunk_overlap: int = 200, window_size: int = INGESTION_WINDOW_SIZE):
+    """ Generator of windows (lists of at most 'window_size' chunks) of a file.
+    Pages are loaded lazily and split one at a time, so the memory does not depend on the document size. """
     filename = os.path.basename(file_path)
 
     if not document_controller(file_path):
@@ -221,16 +475,92 @@ def document_ingestor(file_path: str, chunk_size: int = 1000, chunk_overlap: int
     elif filename.endswith(".docx"):
         loader = Docx2txtLoader(file_path)
 
-    file = loader.load()
     splitter = RecursiveCharacterTextSplitter(chunk_size = chunk_size,
                                             chunk_overlap = chunk_overlap,
-                                            length_function = len)
-    chunks = splitter.split_documents(file)
-    return chunks 
+                                            length_function = len,
+                                            add_start_index = True) # offset in the page, to stitch the retrieved neighbors
+    window = []
+    for page in loader.lazy_load():
+        window.extend(splitter.split_documents([page]))
+        while len(window) >= window_size:
+            yield window[:window_size]
+            window = window[window_size:]
+    if window:
+        yield window
 
+def document_ingestor(file_path: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> list:
+    with telemetry.span("document_ingestor", file = os.path.basename(file_path)) as span:
+        chunks = [chunk for window in document_stream(file_path, chunk_size, chunk_overlap) for chunk in window]
+        span["chunks"] = len(chunks)
+    telemetry.observe("ingested_chunks", len(chunks), stage = "document_ingestor")
+    return chunks
+
+def get_ingestion_engine(qdrant_db: QdrantVectorStore) -> IngestionEngine:
+    return IngestionEngine.from_vector_store(qdrant_db,
+                                             batch_size = EMBEDDING_BATCH_SIZE,
+                                             max_in_flight = EMBEDDING_MAX_IN_FLIGHT,
+                                             max_retries = INGESTION_MAX_RETRIES)
+
+@telemetry.traced("add_documents")
 def add_documents(qdrant_admin: QdrantAdmin, qdrant_db: QdrantVectorStore, chunks: list):
     normalized_chunks = qdrant_admin.chunks_normalization(chunks)
-    qdrant_db.add_documents(normalized_chunks)
+    stats = get_ingestion_engine(qdrant_db).ingest(normalized_chunks, id_function = qdrant_admin.point_id_generator())
+    telemetry.observe("ingested_chunks", stats.chunks, stage = "add_documents")
+
+    # keep the manifest of the collection aligned (one entry per file)
+    texts_per_file = {}
+    for chunk in normalized_chunks:
+        texts_per_file.setdefault(chunk.metadata["clean_filename"], []).append(chunk.page_content)
+    for filename, texts in texts_per_file.items():
+        qdrant_admin.register_file(filename, len(texts), qdrant_admin.content_hash(texts))
+    return stats
+
+@telemetry.traced("add_document_stream")
+def add_document_stream(qdrant_admin: QdrantAdmin, qdrant_db: QdrantVectorStore, windows, update: bool = False):
+    """ Embed and upsert a single file given as a stream of chunk windows (see 'document_stream').
+    Every batch is searchable as soon as it is upserted, while the rest of the file is still processed.
+    With 'update = True' the file is diffed against the stored one: only new or modified chunks are
+    embedded and upserted, and the chunks that are no more in the document are deleted. """
+    stats = IngestionStats()
+    point_id = qdrant_admin.point_id_generator()
+    chunk_hashes, seen_ids = [], set()
+    current_file = {"filename": None, "stored_ids": set()}
+
+    def changed_chunks():
+        for window in windows:
+            for chunk in qdrant_admin.chunks_normalization(window):
+                if current_file["filename"] is None:
+                    current_file["filename"] = chunk.metadata["clean_filename"]
+                    if update:
+                        current_file["stored_ids"] = qdrant_admin.point_ids_of_file(current_file["filename"])
+                chunk_id = point_id(chunk)
+                seen_ids.add(chunk_id)
+                chunk_hashes.append(qdrant_admin.text_hash(chunk.page_content))
+                if chunk_id in current_file["stored_ids"]:
+                    stats.skipped += 1
+                else:
+                    yield chunk_id, chunk
+
+    get_ingestion_engine(qdrant_db).ingest_with_ids(changed_chunks(), stats = stats)
+    if current_file["filename"] is not None:
+        removed_ids = current_file["stored_ids"] - seen_ids
+        qdrant_admin.delete_points(removed_ids)
+        stats.deleted = len(removed_ids)
+        qdrant_admin.register_file(current_file["filename"], len(chunk_hashes), qdrant_admin.combine_hashes(chunk_hashes))
+    telemetry.observe("ingested_chunks", stats.chunks, stage = "add_document_stream")
+    return stats
+
+def reingest(qdrant_admin: QdrantAdmin, qdrant_db: QdrantVectorStore, chunks: list):
+    """ Update a file already in the collection ('chunks' must come from a single file) """
+    normalized_chunks = qdrant_admin.chunks_normalization(chunks)
+    if normalized_chunks:
+        entry = qdrant_admin.file_entry(normalized_chunks[0].metadata["clean_filename"])
+        content_hash = qdrant_admin.content_hash(chunk.page_content for chunk in normalized_chunks)
+        if entry is not None and entry["content_hash"] == content_hash:
+            stats = IngestionStats() # identical content, nothing to do
+            stats.skipped = len(normalized_chunks)
+            return stats
+    return add_document_stream(qdrant_admin, qdrant_db, [normalized_chunks], update = True)
 
 ########################################################
 ################ WORKFLOW VISUALIZATION ################
@@ -276,4 +606,4 @@ def add_documents(qdrant_admin: QdrantAdmin, qdrant_db: QdrantVectorStore, chunk
 # print(qdrant_admin.num_total_points())
 # print(qdrant_admin.unique_filenames())
 
-# qdrant_admin.delete_collection(QDRANT_COLLECTION_NAME)
\ No newline at end of file
+# qdrant_admin.delete_collection() # the collection of the current embedding space
\ No newline at end of file
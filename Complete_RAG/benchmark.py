@@ -0,0 +1,243 @@
+# Offline benchmark of ingestion, retrieval and graph turns: fake chat model and embedder,
+# Qdrant in ':memory:' and an in-memory checkpointer, so it runs without network nor API keys.
+# usage: python benchmark.py 2601.00162v1.pdf 2602.16754v1.pdf --sessions 16 --turns 5 --output bench.json
+
+import os, json, time, zlib, random, asyncio, platform, argparse, subprocess
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.outputs import ChatResult, ChatGeneration
+from langgraph.checkpoint.memory import MemorySaver
+
+from backend import build_backend, build_retriever, document_ingestor, add_documents, CHUNK_SIZE, CHUNK_OVERLAP, TOP_K, LAYOUT_PROFILES
+from embeddings import HashingEmbeddingProvider
+from qdrant_admin import QdrantAdmin
+from retrieval import QdrantRetriever
+
+class FakeChatModel(BaseChatModel):
+    """ Chat model that sleeps 'latency_seconds' and answers with an echo of the last message.
+    Once tools are bound (the team leader), a user question is delegated to 'search_internal_database'
+    with probability 'tool_call_ratio' (deterministic per question). Tokens are counted as characters / 4,
+    so the trimmer and the context assembly work offline too. """
+
+    latency_seconds: float = 0.0
+    tool_call_ratio: float = 1.0
+    tools_bound: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.model_copy(update = {"tools_bound": True})
+
+    def get_num_tokens(self, text: str) -> int:
+        return len(text) // 4 + 1
+
+    def get_num_tokens_from_messages(self, messages: list, tools = None) -> int:
+        return sum(self.get_num_tokens(str(message.content)) + 2 for message in messages)
+
+    def _reply(self, messages: list) -> AIMessage:
+        last = messages[-1]
+        content = str(last.content)
+        if self.tools_bound and isinstance(last, HumanMessage) and zlib.crc32(content.encode()) % 1000 < self.tool_call_ratio * 1000:
+            return AIMessage(content = "", tool_calls = [{"name": "search_internal_database",
+                                                          "args": {"query": content},
+                                                          "id": f"call_{zlib.crc32(content.encode())}"}])
+        return AIMessage(content = f"Answer based on: {content[:200]}")
+
+    def _generate(self, messages, stop = None, run_manager = None, **kwargs) -> ChatResult:
+        time.sleep(self.latency_seconds)
+        return ChatResult(generations = [ChatGeneration(message = self._reply(messages))])
+
+    async def _agenerate(self, messages, stop = None, run_manager = None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.latency_seconds)
+        return ChatResult(generations = [ChatGeneration(message = self._reply(messages))])
+
+class FakeEmbeddings(HashingEmbeddingProvider):
+    """ Hashing embedder that also waits 'latency_seconds' per request, like a remote embedding API """
+
+    def __init__(self, dimensions: int = 384, batch_size: int = 64, latency_seconds: float = 0.0):
+        super().__init__(dimensions = dimensions, batch_size = batch_size)
+        self.latency_seconds = latency_seconds
+
+    def _embed_batch(self, texts: list) -> list:
+        time.sleep(self.latency_seconds)
+        return super()._embed_batch(texts)
+
+    async def _aembed_batch(self, texts: list) -> list:
+        await asyncio.sleep(self.latency_seconds)
+        return super()._embed_batch(texts)
+
+    async def _aembed_query(self, text: str) -> list:
+        return (await self._aembed_batch([text]))[0]
+
+def summarize(latencies: list, wall_seconds: float = None) -> dict:
+    """ Latency percentiles in milliseconds, and throughput (operations per second) over 'wall_seconds' """
+    if not latencies:
+        return {"count": 0}
+    milliseconds = np.asarray(latencies) * 1000
+    wall_seconds = wall_seconds if wall_seconds is not None else float(np.sum(latencies))
+    return {"count": len(latencies),
+            "mean_ms": round(float(np.mean(milliseconds)), 3),
+            "p50_ms": round(float(np.percentile(milliseconds, 50)), 3),
+            "p95_ms": round(float(np.percentile(milliseconds, 95)), 3),
+            "p99_ms": round(float(np.percentile(milliseconds, 99)), 3),
+            "max_ms": round(float(np.max(milliseconds)), 3),
+            "throughput_per_s": round(len(latencies) / wall_seconds, 3) if wall_seconds > 0 else None}
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output = True, text = True,
+                              cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def make_queries(chunks: list, count: int, seed: int) -> list:
+    """ Questions made of twelve consecutive words of random chunks, so that retrieval has something to find """
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        words = rng.choice(chunks).page_content.split()
+        start = rng.randrange(max(1, len(words) - 12))
+        queries.append(" ".join(words[start:start + 12]) + "?")
+    return queries
+
+def bench_ingestion(qdrant_admin: QdrantAdmin, qdrant_db, file_paths: list, chunk_size: int, chunk_overlap: int):
+    parse_latencies, chunks_all = [], []
+    start = time.perf_counter()
+    for file_path in file_paths:
+        chunks, seconds = timed(document_ingestor, file_path, chunk_size = chunk_size, chunk_overlap = chunk_overlap)
+        parse_latencies.append(seconds)
+        chunks_all.extend(chunks)
+    parse_wall = time.perf_counter() - start
+
+    stats, ingest_seconds = timed(add_documents, qdrant_admin, qdrant_db, chunks_all)
+    report = {"files": len(file_paths),
+              "chunks": len(chunks_all),
+              "parse": summarize(parse_latencies, parse_wall),
+              "embed_and_upsert": {"seconds": round(ingest_seconds, 3),
+                                   "chunks_per_second": round(stats.chunks / ingest_seconds, 3) if ingest_seconds > 0 else None,
+                                   "batches": stats.batches,
+                                   "retries": stats.retries}}
+    return report, chunks_all
+
+def bench_retrieval(retriever, queries: list) -> dict:
+    latencies = [timed(retriever.invoke, query)[1] for query in queries]
+    return summarize(latencies)
+
+def turns_summary(results: list, wall_seconds: float) -> dict:
+    """ 'results' are (turn latency, seconds spent building the short-term memory in the last leader call) """
+    summary = summarize([latency for latency, _ in results], wall_seconds)
+    summary["trim"] = summarize([trim_seconds for _, trim_seconds in results])
+    return summary
+
+def run_sessions(graph, questions: list, sessions: int, turns: int, prefix: str) -> dict:
+    """ 'sessions' concurrent threads, each one a conversation (own thread_id) of 'turns' questions """
+    def session(index: int) -> list:
+        config = {"configurable": {"thread_id": f"{prefix}_{index}"}}
+        results = []
+        for turn in range(turns):
+            question = questions[(index * turns + turn) % len(questions)]
+            state, latency = timed(graph.invoke, {"messages": [HumanMessage(content = question)]}, config)
+            results.append((latency, state.get("trim_seconds", 0.0)))
+        return results
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers = sessions) as pool:
+        results = [result for session_results in pool.map(session, range(sessions)) for result in session_results]
+    return turns_summary(results, time.perf_counter() - start)
+
+async def arun_sessions(graph, questions: list, sessions: int, turns: int, prefix: str) -> dict:
+    """ Same as 'run_sessions', with the sessions as coroutines of a single event loop ('ainvoke') """
+    async def session(index: int) -> list:
+        config = {"configurable": {"thread_id": f"{prefix}_{index}"}}
+        results = []
+        for turn in range(turns):
+            question = questions[(index * turns + turn) % len(questions)]
+            start = time.perf_counter()
+            state = await graph.ainvoke({"messages": [HumanMessage(content = question)]}, config)
+            results.append((time.perf_counter() - start, state.get("trim_seconds", 0.0)))
+        return results
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(session(index) for index in range(sessions)))
+    return turns_summary([result for session_results in results for result in session_results], time.perf_counter() - start)
+
+def run_benchmark(file_paths: list, sessions: int = 8, turns: int = 5, queries: int = 200,
+                  llm_latency: float = 0.05, embedding_latency: float = 0.01, tool_call_ratio: float = 1.0,
+                  layout: str = "default", chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP,
+                  seed: int = 0) -> dict:
+    config = {key: value for key, value in locals().items()}
+    llm = FakeChatModel(latency_seconds = llm_latency, tool_call_ratio = tool_call_ratio)
+    embedding_model = FakeEmbeddings(latency_seconds = embedding_latency)
+    qdrant_admin = QdrantAdmin(url = ":memory:",
+                               collection_name = "benchmark_collection",
+                               vector_size = embedding_model.dimensions,
+                               layout = LAYOUT_PROFILES[layout])
+    qdrant_admin.create_collection()
+    qdrant_db, graph = build_backend(llm, embedding_model, qdrant_admin, MemorySaver())
+
+    results = {"config": config,
+               "environment": {"timestamp": datetime.now(timezone.utc).isoformat(),
+                               "git_commit": git_commit(),
+                               "python": platform.python_version(),
+                               "platform": platform.platform()}}
+
+    results["ingestion"], chunks = bench_ingestion(qdrant_admin, qdrant_db, file_paths, chunk_size, chunk_overlap)
+    if not chunks:
+        raise ValueError("The benchmark documents produced no chunks.")
+    questions = make_queries(chunks, queries, seed)
+
+    # the retriever of the tools (reranker, score threshold, cache), and the vector search alone under it
+    results["retrieval"] = bench_retrieval(build_retriever(embedding_model, qdrant_admin), questions)
+    vector_search = QdrantRetriever(qdrant_admin = qdrant_admin, embedding_model = embedding_model,
+                                    k = TOP_K, search_params = qdrant_admin.layout.search_params())
+    results["retrieval_vector_search"] = bench_retrieval(vector_search, questions)
+    results["graph_turn_sequential"] = run_sessions(graph, questions, 1, turns, "sequential")
+    results["graph_turn_concurrent_threads"] = run_sessions(graph, questions, sessions, turns, "threads")
+    # other questions than the threaded run, so the answer and retrieval caches do not flatter the async numbers
+    results["graph_turn_concurrent_async"] = asyncio.run(arun_sessions(graph, questions[::-1], sessions, turns, "async"))
+    return results
+
+def print_summary(results: dict):
+    ingestion = results["ingestion"]
+    print(f"\nIngestion: {ingestion['files']} files, {ingestion['chunks']} chunks, "
+          f"{ingestion['embed_and_upsert']['chunks_per_second']} chunks/s")
+    print(f"\n{'BENCHMARK':<32} {'COUNT':>6} {'P50 [ms]':>10} {'P95 [ms]':>10} {'P99 [ms]':>10} {'OPS/s':>10}")
+    for name in ["retrieval", "retrieval_vector_search", "graph_turn_sequential", "graph_turn_concurrent_threads", "graph_turn_concurrent_async"]:
+        entry = results[name]
+        print(f"{name:<32} {entry['count']:>6} {entry['p50_ms']:>10.2f} {entry['p95_ms']:>10.2f} "
+              f"{entry['p99_ms']:>10.2f} {entry['throughput_per_s']:>10.2f}")
+
+if __name__ == "__main__":
+    default_documents = [os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+                         for filename in ["2601.00162v1.pdf", "2602.16754v1.pdf"]]
+    parser = argparse.ArgumentParser(description = "Offline benchmark of ingestion, retrieval and graph turns.")
+    parser.add_argument("documents", nargs = "*", default = default_documents)
+    parser.add_argument("--sessions", type = int, default = 8, help = "concurrent conversations")
+    parser.add_argument("--turns", type = int, default = 5, help = "questions per conversation")
+    parser.add_argument("--queries", type = int, default = 200, help = "retrieval queries")
+    parser.add_argument("--llm-latency", type = float, default = 0.05, help = "seconds per fake LLM call")
+    parser.add_argument("--embedding-latency", type = float, default = 0.01, help = "seconds per fake embedding request")
+    parser.add_argument("--tool-call-ratio", type = float, default = 1.0, help = "fraction of questions delegated to the tools")
+    parser.add_argument("--layout", default = "default", choices = list(LAYOUT_PROFILES))
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--output", default = "benchmark.json", help = "JSON file with the results, to be diffed across releases")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.documents, sessions = args.sessions, turns = args.turns, queries = args.queries,
+                            llm_latency = args.llm_latency, embedding_latency = args.embedding_latency,
+                            tool_call_ratio = args.tool_call_ratio, layout = args.layout, seed = args.seed)
+    print_summary(results)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent = 2)
+    print(f"\nResults written to '{args.output}'")
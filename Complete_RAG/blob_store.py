@@ -0,0 +1,156 @@
+import time, sqlite3, hashlib, threading, zlib
+from collections import OrderedDict
+from langchain_core.messages import BaseMessage
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+try:
+    import zstandard
+except ImportError: # zlib is used instead
+    zstandard = None
+
+BLOB_MARKER = "\x00blob:sha256:" # content of a message stored in the blob table, followed by the hash
+BLOB_MIN_CHARS = 1024 # shorter contents stay inline in the checkpoints
+KNOWN_HASHES_SIZE = 4096
+LOADED_BLOBS_SIZE = 256
+
+class BlobStore:
+    """ Content-addressed table of compressed message bodies, in the same SQLite file of the checkpoints.
+    A body is written once (INSERT OR IGNORE on its sha256), whatever the number of checkpoints referring to it.
+    It has its own connection: the checkpointer is never blocked waiting for it inside a transaction. """
+
+    def __init__(self, path: str, busy_timeout_ms: int = 5000):
+        self.conn = sqlite3.connect(path, check_same_thread = False, isolation_level = None) # autocommit
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute(f"PRAGMA busy_timeout = {busy_timeout_ms}")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                codec TEXT NOT NULL,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL)""") # time of the last 'put', so the garbage collection spares the blobs in use
+        self.codec = "zstd" if zstandard is not None else "zlib"
+        self._known = OrderedDict() # hashes already in the table, LRU
+        self._loaded = OrderedDict() # hash -> text, LRU
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _compress(self, data: bytes) -> bytes:
+        if self.codec == "zstd":
+            return zstandard.ZstdCompressor(level = 3).compress(data)
+        return zlib.compress(data, 6)
+
+    @staticmethod
+    def _decompress(codec: str, data: bytes) -> bytes:
+        if codec == "zstd":
+            if zstandard is None:
+                raise ImportError("This checkpoint database has zstd blobs: pip install zstandard")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return zlib.decompress(data)
+
+    @staticmethod
+    def _remember(cache: OrderedDict, key, value, max_size: int):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > max_size:
+            cache.popitem(last = False)
+
+    def put(self, text: str) -> str:
+        """ Store 'text' (if new), refresh its 'created_at' and return its hash """
+        text_hash = self.text_hash(text)
+        with self._lock:
+            now = time.time()
+            if text_hash in self._known: # the same tool output is in every following checkpoint of the thread
+                # no compression for a known blob, but the row is checked: another process may have collected it
+                if self.conn.execute("UPDATE blobs SET created_at = ? WHERE hash = ?", (now, text_hash)).rowcount:
+                    self._known.move_to_end(text_hash)
+                    return text_hash
+            data = text.encode("utf-8")
+            self.conn.execute("""
+                INSERT INTO blobs (hash, codec, data, size, created_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (hash) DO UPDATE SET created_at = excluded.created_at""",
+                (text_hash, self.codec, self._compress(data), len(data), now))
+            self._remember(self._known, text_hash, True, KNOWN_HASHES_SIZE)
+        return text_hash
+
+    def get(self, text_hash: str) -> str:
+        with self._lock:
+            if text_hash in self._loaded:
+                self._loaded.move_to_end(text_hash)
+                return self._loaded[text_hash]
+            row = self.conn.execute("SELECT codec, data FROM blobs WHERE hash = ?", (text_hash,)).fetchone()
+            if row is None:
+                raise KeyError(f"The blob '{text_hash}' referenced by a checkpoint is missing.")
+            text = self._decompress(row[0], row[1]).decode("utf-8")
+            self._remember(self._loaded, text_hash, text, LOADED_BLOBS_SIZE)
+            return text
+
+def collect_garbage(conn: sqlite3.Connection, grace_seconds: float = 3600, dry_run: bool = False) -> int:
+    """ Delete the blobs no checkpoint refers to (the hash is searched in the serialized checkpoints).
+    Blobs put less than 'grace_seconds' before the start of the collection are kept: their checkpoint
+    may still be on its way. The candidates found by the scan are checked again when deleted, so a blob
+    put again or referenced by a checkpoint written while the collection runs is not deleted. """
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if not {"blobs", "checkpoints"} <= tables:
+        return 0
+    cutoff = time.time() - grace_seconds
+    unreferenced = """
+        created_at < ? AND NOT EXISTS (
+            SELECT 1 FROM checkpoints WHERE instr(checkpoint, CAST(blobs.hash AS BLOB)) > 0)"""
+    candidates = [row[0] for row in conn.execute(f"SELECT hash FROM blobs WHERE {unreferenced}", (cutoff,))]
+    if dry_run:
+        return len(candidates)
+    deleted = 0
+    with conn:
+        for text_hash in candidates:
+            deleted += conn.execute(f"DELETE FROM blobs WHERE hash = ? AND {unreferenced}", (text_hash, cutoff)).rowcount
+    return deleted
+
+class BlobSerializer:
+    """ Checkpoint serializer: the string contents longer than 'min_chars' of the messages in the state
+    (tool outputs, long answers) are moved to the BlobStore and replaced by a reference, so a checkpoint
+    only carries one marker per long message instead of re-serializing its text at every step.
+    The other values (and the pending writes) go through the wrapped serializer unchanged. """
+
+    def __init__(self, blob_store: BlobStore, serde = None, min_chars: int = BLOB_MIN_CHARS):
+        self.blob_store = blob_store
+        self.serde = serde if serde is not None else JsonPlusSerializer()
+        self.min_chars = min_chars
+
+    def _externalize(self, value):
+        if isinstance(value, list) and value and all(isinstance(item, BaseMessage) for item in value):
+            return [self._externalize_message(message) for message in value]
+        return value
+
+    def _externalize_message(self, message: BaseMessage) -> BaseMessage:
+        if isinstance(message.content, str) and len(message.content) >= self.min_chars:
+            # a copy: the message is still in the live state of the graph
+            return message.model_copy(update = {"content": BLOB_MARKER + self.blob_store.put(message.content)})
+        return message
+
+    def restore(self, value):
+        """ Resolve in place the blob references of a list of messages (es a page of a thread) """
+        if isinstance(value, list):
+            for message in value:
+                if isinstance(message, BaseMessage) and isinstance(message.content, str) and message.content.startswith(BLOB_MARKER):
+                    message.content = self.blob_store.get(message.content[len(BLOB_MARKER):])
+        return value
+
+    @staticmethod
+    def _is_checkpoint(obj) -> bool:
+        return isinstance(obj, dict) and "channel_values" in obj and "id" in obj
+
+    def dumps_typed(self, obj):
+        if self._is_checkpoint(obj):
+            obj = {**obj, "channel_values": {channel: self._externalize(value) for channel, value in obj["channel_values"].items()}}
+        return self.serde.dumps_typed(obj)
+
+    def loads_typed(self, data):
+        obj = self.serde.loads_typed(data)
+        if self._is_checkpoint(obj):
+            for value in obj["channel_values"].values():
+                self.restore(value)
+        return obj
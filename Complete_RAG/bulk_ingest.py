@@ -0,0 +1,114 @@
+# Bulk ingestion of a directory tree into the Qdrant collection of the app.
+# usage: python bulk_ingest.py ./course_documents --workers 8
+
+import os, time, argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from backend import backend_setup, document_controller, document_ingestor, get_ingestion_engine
+from backend import CHUNK_SIZE, CHUNK_OVERLAP
+from ingestion import IngestionStats
+
+def find_documents(directory: str) -> list:
+    file_paths = []
+    for root, _, filenames in os.walk(directory):
+        for filename in sorted(filenames):
+            file_path = os.path.join(root, filename)
+            if document_controller(file_path):
+                file_paths.append(file_path)
+    return file_paths
+
+def parse_file(file_path: str, chunk_size: int, chunk_overlap: int):
+    """ Run in a worker process: parsing and splitting are CPU-bound """
+    start = time.perf_counter()
+    try:
+        chunks = document_ingestor(file_path, chunk_size = chunk_size, chunk_overlap = chunk_overlap)
+        return file_path, chunks, time.perf_counter() - start, None
+    except Exception as e:
+        return file_path, [], time.perf_counter() - start, str(e)
+
+def parsed_files(file_paths: list, workers: int, chunk_size: int, chunk_overlap: int):
+    """ Yield the parsed files as soon as they are ready, with at most 2 x workers files in memory """
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        pending = set()
+        file_paths = iter(file_paths)
+        while True:
+            for file_path in file_paths:
+                pending.add(pool.submit(parse_file, file_path, chunk_size, chunk_overlap))
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                return
+            done, pending = wait(pending, return_when = FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+def bulk_ingest(directory: str, workers: int, chunk_size: int, chunk_overlap: int) -> dict:
+    qdrant_admin, qdrant_db, _ = backend_setup()
+
+    report = {} # filename -> per-file timings
+    file_paths = []
+    for file_path in find_documents(directory):
+        filename = os.path.basename(file_path)
+        if filename in report:
+            print(f"⚠️ Skipping '{file_path}': another file named '{filename}' is in the tree.")
+        elif qdrant_admin.is_file_in_db(filename = filename):
+            report[filename] = {"status": "already in db"}
+        else:
+            report[filename] = {"status": "queued", "chunks": 0}
+            file_paths.append(file_path)
+
+    start = time.perf_counter()
+    pending_chunks = {}
+    chunk_hashes = {}
+
+    def register_if_complete(filename):
+        # the manifest entry is written only when all the chunks of the file are in Qdrant
+        if pending_chunks[filename] == 0:
+            qdrant_admin.register_file(filename, report[filename]["chunks"], qdrant_admin.combine_hashes(chunk_hashes.pop(filename)))
+            report[filename]["status"] = "ingested"
+            report[filename]["done_at"] = time.perf_counter() - start
+
+    def on_batch_upserted(chunks):
+        for chunk in chunks:
+            pending_chunks[chunk.metadata["clean_filename"]] -= 1
+        for filename in {chunk.metadata["clean_filename"] for chunk in chunks}:
+            register_if_complete(filename)
+
+    def all_chunks():
+        for file_path, chunks, parse_seconds, error in parsed_files(file_paths, workers, chunk_size, chunk_overlap):
+            filename = os.path.basename(file_path)
+            report[filename]["parse_seconds"] = parse_seconds
+            if error:
+                report[filename]["status"] = f"error: {error}"
+                continue
+            chunks = qdrant_admin.chunks_normalization(chunks)
+            report[filename]["chunks"] = len(chunks)
+            pending_chunks[filename] = len(chunks)
+            chunk_hashes[filename] = [qdrant_admin.text_hash(chunk.page_content) for chunk in chunks]
+            if not chunks:
+                register_if_complete(filename)
+            point_id = qdrant_admin.point_id_generator()
+            for chunk in chunks:
+                yield point_id(chunk), chunk
+
+    # a single embedding/upsert pipeline is shared by all the files
+    stats = get_ingestion_engine(qdrant_db).ingest_with_ids(all_chunks(), stats = IngestionStats(), on_batch_upserted = on_batch_upserted)
+    print_report(report, stats)
+    return report
+
+def print_report(report: dict, stats: IngestionStats):
+    print(f"\n{'FILE':<50} {'STATUS':<16} {'CHUNKS':>7} {'PARSE [s]':>10} {'DONE AT [s]':>12}")
+    for filename, entry in sorted(report.items()):
+        print(f"{filename[:50]:<50} {entry['status'][:16]:<16} {entry.get('chunks', 0):>7} "
+              f"{entry.get('parse_seconds', 0):>10.2f} {entry.get('done_at', 0):>12.2f}")
+    print(f"\n{stats}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Ingest all the PDF, DOCX and TXT files of a directory tree.")
+    parser.add_argument("directory")
+    parser.add_argument("--workers", type = int, default = os.cpu_count(), help = "parsing processes")
+    parser.add_argument("--chunk-size", type = int, default = CHUNK_SIZE)
+    parser.add_argument("--chunk-overlap", type = int, default = CHUNK_OVERLAP)
+    args = parser.parse_args()
+
+    bulk_ingest(args.directory, args.workers, args.chunk_size, args.chunk_overlap)
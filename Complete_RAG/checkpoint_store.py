@@ -0,0 +1,171 @@
+# Connection setup and maintenance of the SQLite checkpoint database (session_history.db).
+# usage: python checkpoint_store.py session_history.db --keep-last 20 --ttl-days 30 [--vacuum] [--dry-run]
+
+import os, time, sqlite3, argparse
+from langchain_core.messages import HumanMessage
+from langgraph.checkpoint.sqlite import SqliteSaver
+from blob_store import BlobStore, BlobSerializer, collect_garbage
+
+# WAL lets the readers go on while a checkpoint is written, and synchronous=NORMAL is durable in WAL mode
+# except for the last transactions on a power loss (a checkpoint, not a document)
+PRAGMAS = {"journal_mode": "WAL",
+           "synchronous": "NORMAL",
+           "busy_timeout": 5000, # ms waited on a lock held by another process (es the maintenance CLI)
+           "cache_size": -16000, # KiB
+           "temp_store": "MEMORY",
+           "mmap_size": 128 * 1024 * 1024,
+           "journal_size_limit": 64 * 1024 * 1024} # the WAL file is truncated to this size after a checkpoint
+SESSION_THREAD_PATTERN = "%\\_session\\_%" # threads created by "Clean chat": f"{USER_NAME}_session_{id}"
+UUID_EPOCH_OFFSET = 0x01B21DD213814000 # 100 ns intervals between 1582-10-15 and 1970-01-01
+
+def checkpoint_timestamp(checkpoint_id: str) -> float:
+    """ Unix time of a checkpoint, read from its id (a uuid6: the timestamp is in the first 60 bits) """
+    hex_id = checkpoint_id.replace("-", "")
+    timestamp = (int(hex_id[0:12], 16) << 12) | int(hex_id[13:16], 16)
+    return (timestamp - UUID_EPOCH_OFFSET) / 1e7
+
+def apply_pragmas(conn: sqlite3.Connection):
+    for name, value in PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+
+def connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread = False)
+    apply_pragmas(conn)
+    conn.create_function("checkpoint_timestamp", 1, checkpoint_timestamp, deterministic = True)
+    return conn
+
+def checkpoint_serializer(path: str) -> BlobSerializer:
+    """ Serializer keeping the long message bodies in the blob table of the database (see 'blob_store.py') """
+    return BlobSerializer(BlobStore(path))
+
+def open_checkpointer(path: str) -> SqliteSaver:
+    """ SqliteSaver on a tuned connection. The saver serializes its statements with a lock,
+    so the Streamlit threads share one writer instead of contending on the database lock. """
+    return SqliteSaver(connect(path), serde = checkpoint_serializer(path))
+
+async def aconnect(path: str):
+    """ aiosqlite twin of 'connect', for AsyncSqliteSaver """
+    import aiosqlite
+    conn = await aiosqlite.connect(path)
+    for name, value in PRAGMAS.items():
+        await conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+def latest_checkpoint_id(checkpointer: SqliteSaver, thread_id: str, checkpoint_ns: str = ""):
+    """ Id of the last checkpoint of a thread (None for a new thread), without deserializing it """
+    with checkpointer.cursor(transaction = False) as cur:
+        row = cur.execute("SELECT MAX(checkpoint_id) FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?",
+                          (thread_id, checkpoint_ns)).fetchone()
+    return row[0] if row else None
+
+def thread_messages(checkpointer: SqliteSaver, thread_id: str, last_turns: int, checkpoint_id: str = None) -> tuple:
+    """ (messages of the last 'last_turns' turns, number of turns of the thread) in a checkpoint of a thread
+    (the last one by default). The row is read as is, without the pending writes nor the graph tasks of
+    'get_state', and only the long bodies of the returned messages are read from the blob table:
+    the messages of a thread are a single value of the checkpoint, the older ones are decoded but not loaded. """
+    serde = checkpointer.serde
+    with checkpointer.cursor(transaction = False) as cur:
+        if checkpoint_id is None:
+            row = cur.execute("""SELECT type, checkpoint FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ''
+                                 ORDER BY checkpoint_id DESC LIMIT 1""", (thread_id,)).fetchone()
+        else:
+            row = cur.execute("""SELECT type, checkpoint FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ''
+                                 AND checkpoint_id = ?""", (thread_id, checkpoint_id)).fetchone()
+    if row is None:
+        return [], 0
+    # the wrapped serializer leaves the blob references in place
+    checkpoint = (serde.serde if isinstance(serde, BlobSerializer) else serde).loads_typed((row[0], row[1]))
+    messages = checkpoint["channel_values"].get("messages", [])
+    turn_starts = [i for i, message in enumerate(messages) if isinstance(message, HumanMessage)]
+    page = messages[turn_starts[-last_turns]:] if len(turn_starts) > last_turns else messages
+    if isinstance(serde, BlobSerializer):
+        serde.restore(page)
+    return page, len(turn_starts)
+
+def _has_checkpoints(conn: sqlite3.Connection) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'checkpoints'").fetchone() is not None
+
+def compact(conn: sqlite3.Connection, keep_last: int, dry_run: bool = False) -> int:
+    """ Keep only the latest 'keep_last' checkpoints (and their pending writes) of every thread.
+    Every checkpoint holds the full state of the thread, so the latest one is enough to resume it;
+    the older ones only serve the time travel. Checkpoint ids are uuid6, so they sort by time. """
+    if not _has_checkpoints(conn):
+        return 0
+    old_checkpoints = """
+        SELECT thread_id, checkpoint_ns, checkpoint_id FROM (
+            SELECT thread_id, checkpoint_ns, checkpoint_id,
+                   ROW_NUMBER() OVER (PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC) AS position
+            FROM checkpoints)
+        WHERE position > ?"""
+    if dry_run:
+        return conn.execute(f"SELECT COUNT(*) FROM ({old_checkpoints})", (keep_last,)).fetchone()[0]
+    with conn:
+        deleted = conn.execute(f"""
+            DELETE FROM checkpoints WHERE (thread_id, checkpoint_ns, checkpoint_id) IN ({old_checkpoints})""",
+            (keep_last,)).rowcount
+        conn.execute("""
+            DELETE FROM writes WHERE NOT EXISTS (
+                SELECT 1 FROM checkpoints AS c
+                WHERE c.thread_id = writes.thread_id AND c.checkpoint_ns = writes.checkpoint_ns
+                      AND c.checkpoint_id = writes.checkpoint_id)""")
+    return deleted
+
+def purge_sessions(conn: sqlite3.Connection, ttl_seconds: float, pattern: str = SESSION_THREAD_PATTERN, dry_run: bool = False) -> list:
+    """ Delete the threads matching 'pattern' (LIKE, '\\' as escape) whose last checkpoint is older than 'ttl_seconds' """
+    if not _has_checkpoints(conn):
+        return []
+    thread_ids = [row[0] for row in conn.execute("""
+        SELECT thread_id FROM checkpoints WHERE thread_id LIKE ? ESCAPE '\\'
+        GROUP BY thread_id HAVING checkpoint_timestamp(MAX(checkpoint_id)) < ?""",
+        (pattern, time.time() - ttl_seconds))]
+    if not dry_run:
+        with conn:
+            for thread_id in thread_ids:
+                conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+                conn.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+    return thread_ids
+
+def checkpoint_stats(conn: sqlite3.Connection) -> dict:
+    if not _has_checkpoints(conn):
+        return {"threads": 0, "checkpoints": 0, "writes": 0, "blobs": 0, "size_mb": 0.0}
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    has_blobs = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'blobs'").fetchone() is not None
+    return {"threads": conn.execute("SELECT COUNT(DISTINCT thread_id) FROM checkpoints").fetchone()[0],
+            "checkpoints": conn.execute("SELECT COUNT(*) FROM checkpoints").fetchone()[0],
+            "writes": conn.execute("SELECT COUNT(*) FROM writes").fetchone()[0],
+            "blobs": conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0] if has_blobs else 0,
+            "size_mb": round(page_count * page_size / 2**20, 2)}
+
+def maintain(conn: sqlite3.Connection, keep_last: int, ttl_seconds: float = None, vacuum: bool = False, dry_run: bool = False) -> dict:
+    """ TTL purge of the abandoned "Clean chat" threads, compaction of the others, then deletion
+    of the message bodies no longer referenced by a checkpoint.
+    Freed pages are reused by the next checkpoints; 'vacuum' also gives them back to the file system. """
+    report = {"before": checkpoint_stats(conn)}
+    report["purged_threads"] = purge_sessions(conn, ttl_seconds, dry_run = dry_run) if ttl_seconds else []
+    report["deleted_checkpoints"] = compact(conn, keep_last, dry_run = dry_run)
+    report["deleted_blobs"] = collect_garbage(conn, dry_run = dry_run)
+    if not dry_run:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        if vacuum:
+            conn.execute("VACUUM")
+    report["after"] = checkpoint_stats(conn)
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Compaction and retention of the checkpoint database.")
+    parser.add_argument("path", nargs = "?", default = "session_history.db")
+    parser.add_argument("--keep-last", type = int, default = 20, help = "checkpoints kept per thread")
+    parser.add_argument("--ttl-days", type = float, default = 30, help = "age of the last checkpoint of a purged session (0: no purge)")
+    parser.add_argument("--vacuum", action = "store_true", help = "shrink the file (rewrites the whole database)")
+    parser.add_argument("--dry-run", action = "store_true", help = "only report what would be deleted")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        raise SystemExit(f"'{args.path}' does not exist.")
+    report = maintain(connect(args.path), args.keep_last, args.ttl_days * 24 * 3600, vacuum = args.vacuum, dry_run = args.dry_run)
+    print(f"Before: {report['before']}")
+    print(f"Purged sessions: {len(report['purged_threads'])} {report['purged_threads'][:10]}")
+    print(f"Deleted checkpoints: {report['deleted_checkpoints']}")
+    print(f"Deleted blobs: {report['deleted_blobs']}")
+    print(f"After: {report['after']}")
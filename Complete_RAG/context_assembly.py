@@ -0,0 +1,179 @@
+import re
+from langchain_core.documents import Document
+
+MIN_OVERLAP_CHARS = 20 # shorter common spans between two chunks are not considered an overlap
+WORD_PATTERN = re.compile(r"\w+")
+
+def _suffix_prefix_overlap(left: str, right: str, max_overlap: int, min_overlap: int = MIN_OVERLAP_CHARS) -> int:
+    """ Length of the longest suffix of 'left' that is a prefix of 'right' (0 if shorter than 'min_overlap') """
+    if len(left) < min_overlap or len(right) < min_overlap:
+        return 0
+    probe = right[:min_overlap]
+    position = left.find(probe, max(0, len(left) - max_overlap))
+    while position != -1:
+        if right.startswith(left[position:]):
+            return len(left) - position
+        position = left.find(probe, position + 1)
+    return 0
+
+def _words(text: str) -> set:
+    return set(WORD_PATTERN.findall(text.lower()))
+
+def _jaccard(left: set, right: set) -> float:
+    if not left or not right:
+        return 0.0
+    return len(left & right) / len(left | right)
+
+class ContextAssembler:
+    """ Turns the retrieved chunks into the context of the generation, in three steps:
+    1) the hits are grouped by (clean_filename, page);
+    2) inside a group, overlapping or adjacent chunks (the splitter repeats 'chunk_overlap' characters)
+       are stitched back into a single span: by 'start_index' when the chunks have it, otherwise by
+       matching the end of a chunk with the beginning of another one;
+    3) the spans are selected with MMR (score of the best chunk of the span vs word overlap with the
+       spans already selected) until 'max_tokens' is used; near-duplicates are dropped.
+    The retrieved documents are not modified: the retrieval cache may hand them out again. """
+
+    def __init__(self, token_counter = None, max_tokens: int = 1500, mmr_lambda: float = 0.7,
+                 redundancy_threshold: float = 0.8, chunk_overlap: int = 200):
+        self.token_counter = token_counter # a chat model (get_num_tokens) or a callable on a string, 4 chars per token otherwise
+        self.max_tokens = max_tokens
+        self.mmr_lambda = mmr_lambda
+        self.redundancy_threshold = redundancy_threshold
+        self.chunk_overlap = chunk_overlap
+
+    def count(self, text: str) -> int:
+        if self.token_counter is None:
+            return len(text) // 4 + 1
+        if hasattr(self.token_counter, "get_num_tokens"):
+            return self.token_counter.get_num_tokens(text)
+        return self.token_counter(text)
+
+    @staticmethod
+    def _score_key(doc: Document) -> str:
+        # the score of the reranker, when there is one, is the relevance used by the MMR
+        return "_rerank_score" if "_rerank_score" in doc.metadata else "_score"
+
+    def _span(self, doc: Document, rank: int) -> dict:
+        return {"text": doc.page_content,
+                "metadata": doc.metadata,
+                "start": doc.metadata.get("start_index"),
+                "score": doc.metadata.get(self._score_key(doc)),
+                "rank": rank,
+                "chunks": 1}
+
+    @staticmethod
+    def _merge(left: dict, right: dict, text: str) -> dict:
+        scores = [score for score in (left["score"], right["score"]) if score is not None]
+        vector_scores = [span["metadata"]["_score"] for span in (left, right) if "_score" in span["metadata"]]
+        metadata = left["metadata"] if left["rank"] <= right["rank"] else right["metadata"]
+        return {"text": text,
+                "metadata": {**metadata, "_score": max(vector_scores)} if vector_scores else metadata,
+                "start": left["start"],
+                "score": max(scores) if scores else None,
+                "rank": min(left["rank"], right["rank"]),
+                "chunks": left["chunks"] + right["chunks"]}
+
+    def _stitch_by_offset(self, spans: list):
+        """ Stitched spans, None if an offset does not match the text (es stale offsets of chunks skipped by an update) """
+        spans = sorted(spans, key = lambda span: span["start"])
+        stitched = [spans[0]]
+        for span in spans[1:]:
+            current = stitched[-1]
+            current_end = current["start"] + len(current["text"])
+            if span["start"] > current_end + 1: # a gap: the text in between was not retrieved
+                stitched.append(span)
+                continue
+            shared = current["text"][span["start"] - current["start"]:]
+            if not span["text"].startswith(shared) and not shared.startswith(span["text"]):
+                return None
+            if span["start"] + len(span["text"]) <= current_end: # contained in the current span
+                stitched[-1] = self._merge(current, span, current["text"])
+            else:
+                tail = span["text"][len(shared):] if shared else " " * (span["start"] - current_end) + span["text"]
+                stitched[-1] = self._merge(current, span, current["text"] + tail)
+        return stitched
+
+    def _stitch_by_text(self, spans: list) -> list:
+        spans = sorted(spans, key = lambda span: span["rank"])
+        merged = True
+        while merged and len(spans) > 1:
+            merged = False
+            for i, left in enumerate(spans):
+                for j, right in enumerate(spans):
+                    if i == j:
+                        continue
+                    if right["text"] in left["text"]:
+                        text = left["text"]
+                    else:
+                        overlap = _suffix_prefix_overlap(left["text"], right["text"], self.chunk_overlap * 2)
+                        if not overlap:
+                            continue
+                        text = left["text"] + right["text"][overlap:]
+                    spans[i] = self._merge(left, right, text)
+                    del spans[j]
+                    merged = True
+                    break
+                if merged:
+                    break
+        return spans
+
+    def stitch(self, retrieved_docs: list) -> list:
+        """ Spans (dicts) of the chunks grouped by (file, page), with the overlapping chunks merged """
+        groups = {}
+        for rank, doc in enumerate(retrieved_docs):
+            key = (doc.metadata.get("clean_filename"), doc.metadata.get("page"))
+            groups.setdefault(key, []).append(self._span(doc, rank))
+        spans = []
+        for group in groups.values():
+            if len(group) == 1:
+                spans.extend(group)
+            else:
+                # chunks ingested before 'start_index' was stored, or whose offsets are stale, are matched by text
+                stitched = self._stitch_by_offset(group) if all(span["start"] is not None for span in group) else None
+                spans.extend(stitched if stitched is not None else self._stitch_by_text(group))
+        return spans
+
+    def select(self, spans: list) -> list:
+        """ MMR selection of the spans within the token budget """
+        scores = [span["score"] for span in spans if span["score"] is not None]
+        low, high = (min(scores), max(scores)) if scores else (0.0, 0.0)
+        for span in spans:
+            if span["score"] is None or high == low:
+                span["relevance"] = 1.0 / (1 + span["rank"]) # retrieval order
+            else:
+                span["relevance"] = (span["score"] - low) / (high - low)
+            span["words"] = _words(span["text"])
+            span["tokens"] = self.count(span["text"])
+
+        selected, remaining, budget = [], list(spans), self.max_tokens
+        while remaining:
+            best, best_value = None, None
+            for span in remaining:
+                redundancy = max((_jaccard(span["words"], chosen["words"]) for chosen in selected), default = 0.0)
+                if redundancy >= self.redundancy_threshold:
+                    span["redundant"] = True
+                    continue
+                value = self.mmr_lambda * span["relevance"] - (1 - self.mmr_lambda) * redundancy
+                if best is None or value > best_value:
+                    best, best_value = span, value
+            remaining = [span for span in remaining if span is not best and not span.get("redundant")]
+            if best is None:
+                break
+            if best["tokens"] > budget and selected: # the first span is always kept, even if over budget
+                continue
+            selected.append(best)
+            budget -= best["tokens"]
+        return selected
+
+    def assemble(self, retrieved_docs: list) -> list:
+        """ Documents to format for the generation: stitched, deduplicated and within the token budget """
+        if len(retrieved_docs) <= 1:
+            return retrieved_docs
+        docs = []
+        for span in self.select(self.stitch(retrieved_docs)):
+            metadata = {**span["metadata"], "merged_chunks": span["chunks"]}
+            if span["score"] is not None and "_rerank_score" in metadata:
+                metadata["_rerank_score"] = span["score"]
+            docs.append(Document(page_content = span["text"], metadata = metadata))
+        return docs
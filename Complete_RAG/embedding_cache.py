@@ -0,0 +1,115 @@
+import time, sqlite3, hashlib, threading
+from array import array
+from langchain_core.embeddings import Embeddings
+from telemetry import telemetry
+
+class CachedEmbeddings(Embeddings):
+    """ Wrapper around a LangChain embedding model with a persistent, content-addressed cache.
+    Vectors are stored in SQLite (as float32) under the key (model name, dimensions, sha256 of the text),
+    so unchanged chunks and repeated queries are never sent twice to the embedding API.
+    When the cache exceeds 'max_size_mb', the least recently used vectors are evicted. """
+
+    def __init__(self, embedding_model: Embeddings, path: str, model_name: str, dimensions: int, max_size_mb: int = 512):
+        self.embedding_model = embedding_model
+        self.model_name = model_name
+        self.dimensions = dimensions
+        self.max_entries = max(1, max_size_mb * 2**20 // (4 * dimensions))
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock() # the ingestion engine embeds from several threads
+        self._conn = sqlite3.connect(path, check_same_thread = False)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS embeddings (
+                                key TEXT PRIMARY KEY,
+                                vector BLOB NOT NULL,
+                                last_access REAL NOT NULL)""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)")
+        self._conn.commit()
+        self._num_entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _key(self, text: str, kind: str) -> str:
+        # queries and documents have separate keys: some models embed them differently
+        text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{self.model_name}:{self.dimensions}:{kind}:{text_hash}"
+
+    def _lookup(self, keys: list) -> dict:
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), 500): # limit on the number of sqlite variables
+                batch = keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch)
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+                self._conn.execute(f"UPDATE embeddings SET last_access = ? WHERE key IN ({placeholders})",
+                                   [time.time()] + batch)
+            self._conn.commit()
+        return found
+
+    def _store(self, keys: list, vectors: list):
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)",
+                [(key, array("f", vector).tobytes(), now) for key, vector in zip(keys, vectors)])
+            self._num_entries += cursor.rowcount
+            if self._num_entries > self.max_entries:
+                # evict down to 90% of the capacity, to not evict at every insert
+                to_evict = self._num_entries - int(self.max_entries * 0.9)
+                self._conn.execute("""DELETE FROM embeddings WHERE key IN (
+                                        SELECT key FROM embeddings ORDER BY last_access LIMIT ?)""", (to_evict,))
+                self._num_entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            self._conn.commit()
+
+    def _split(self, texts: list, kind: str):
+        """ Return the keys of the texts, the cached vectors and the missing texts (key -> text) """
+        keys = [self._key(text, kind) for text in texts]
+        found = self._lookup(list(set(keys)))
+
+        missing = {} # key -> text, also deduplicates identical texts in the same request
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        num_misses = sum(1 for key in keys if key in missing)
+        self.hits += len(texts) - num_misses
+        self.misses += num_misses
+        telemetry.increment("cache_requests_total", len(texts) - num_misses, cache = "embedding", result = "hit")
+        telemetry.increment("cache_requests_total", num_misses, cache = "embedding", result = "miss")
+        return keys, found, missing
+
+    def _merge(self, keys: list, found: dict, missing: dict, new_vectors: list) -> list:
+        if missing:
+            self._store(list(missing.keys()), new_vectors)
+            found.update(zip(missing.keys(), new_vectors))
+        return [found[key] for key in keys]
+
+    def embed_documents(self, texts: list) -> list:
+        keys, found, missing = self._split(texts, "document")
+        new_vectors = self.embedding_model.embed_documents(list(missing.values())) if missing else []
+        return self._merge(keys, found, missing, new_vectors)
+
+    def embed_query(self, text: str) -> list:
+        keys, found, missing = self._split([text], "query")
+        new_vectors = [self.embedding_model.embed_query(text)] if missing else []
+        return self._merge(keys, found, missing, new_vectors)[0]
+
+    # the sqlite lookups are local and fast, only the calls to the model are awaited
+    async def aembed_documents(self, texts: list) -> list:
+        keys, found, missing = self._split(texts, "document")
+        new_vectors = await self.embedding_model.aembed_documents(list(missing.values())) if missing else []
+        return self._merge(keys, found, missing, new_vectors)
+
+    async def aembed_query(self, text: str) -> list:
+        keys, found, missing = self._split([text], "query")
+        new_vectors = [await self.embedding_model.aembed_query(text)] if missing else []
+        return self._merge(keys, found, missing, new_vectors)[0]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": self._num_entries,
+                "max_entries": self.max_entries}
@@ -0,0 +1,143 @@
+import os, re, math, asyncio, hashlib
+from abc import abstractmethod
+from langchain_core.embeddings import Embeddings
+
+class EmbeddingProvider(Embeddings):
+    """ Common interface of the embedding backends, shared by ingestion and retrieval.
+    Texts are sent to the model in batches of at most 'batch_size', and every returned vector
+    is checked against 'dimensions' (the size of the Qdrant collection). """
+
+    provider_name = None
+    default_model_name = None
+    default_dimensions = None
+
+    def __init__(self, model_name: str = None, dimensions: int = None, batch_size: int = 64):
+        self.model_name = model_name or self.default_model_name
+        self.dimensions = dimensions or self.default_dimensions
+        self.batch_size = batch_size
+
+    @property
+    def vector_space(self) -> str:
+        """ Id of the vector space (provider, model, dimensions), usable in a Qdrant collection name:
+        vectors of different spaces must never be stored in, or searched against, the same collection """
+        return re.sub(r"[^A-Za-z0-9]+", "-", f"{self.provider_name}-{self.model_name}-{self.dimensions}").strip("-").lower()
+
+    @abstractmethod
+    def _embed_batch(self, texts: list) -> list:
+        """ Vectors of a batch of at most 'batch_size' texts """
+
+    def _embed_query(self, text: str) -> list:
+        return self._embed_batch([text])[0]
+
+    async def _aembed_batch(self, texts: list) -> list:
+        return await asyncio.to_thread(self._embed_batch, texts)
+
+    async def _aembed_query(self, text: str) -> list:
+        return await asyncio.to_thread(self._embed_query, text)
+
+    def _check(self, vectors: list) -> list:
+        for vector in vectors:
+            if len(vector) != self.dimensions:
+                raise ValueError(f"The embedding model '{self.model_name}' returned a vector of size {len(vector)}, "
+                                 f"but {self.dimensions} was expected.")
+        return vectors
+
+    def embed_documents(self, texts: list) -> list:
+        vectors = []
+        for i in range(0, len(texts), self.batch_size):
+            vectors.extend(self._check(self._embed_batch(texts[i:i + self.batch_size])))
+        return vectors
+
+    def embed_query(self, text: str) -> list:
+        return self._check([self._embed_query(text)])[0]
+
+    async def aembed_documents(self, texts: list) -> list:
+        vectors = []
+        for i in range(0, len(texts), self.batch_size):
+            vectors.extend(self._check(await self._aembed_batch(texts[i:i + self.batch_size])))
+        return vectors
+
+    async def aembed_query(self, text: str) -> list:
+        return self._check([await self._aembed_query(text)])[0]
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """ OpenAI embeddings API (needs OPENAI_API_KEY) """
+
+    provider_name = "openai"
+    default_model_name = "text-embedding-3-small"
+    default_dimensions = 1536 # default of 'text-embedding-3-small'
+
+    def __init__(self, model_name: str = None, dimensions: int = None, batch_size: int = 64):
+        super().__init__(model_name, dimensions, batch_size)
+        from langchain_openai import OpenAIEmbeddings
+        self.model = OpenAIEmbeddings(model = self.model_name, dimensions = self.dimensions, chunk_size = batch_size)
+
+    def _embed_batch(self, texts: list) -> list:
+        return self.model.embed_documents(texts)
+
+    def _embed_query(self, text: str) -> list:
+        return self.model.embed_query(text)
+
+    async def _aembed_batch(self, texts: list) -> list:
+        return await self.model.aembed_documents(texts)
+
+    async def _aembed_query(self, text: str) -> list:
+        return await self.model.aembed_query(text)
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """ In-process sentence-transformers model on CPU, with batched inference.
+    It requires 'pip install sentence-transformers'; the dimensions are read from the model. """
+
+    provider_name = "local"
+    default_model_name = "sentence-transformers/all-MiniLM-L6-v2"
+
+    def __init__(self, model_name: str = None, dimensions: int = None, batch_size: int = 64):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError("The 'local' embedding provider requires: pip install sentence-transformers") from e
+        super().__init__(model_name, dimensions, batch_size)
+        self.model = SentenceTransformer(self.model_name, device = "cpu")
+        self.dimensions = dimensions or self.model.get_sentence_embedding_dimension()
+
+    def _embed_batch(self, texts: list) -> list:
+        vectors = self.model.encode(texts, batch_size = self.batch_size, normalize_embeddings = True,
+                                    convert_to_numpy = True, show_progress_bar = False)
+        return vectors.tolist()
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """ Deterministic feature-hashing embedder: words and word bigrams are hashed into 'dimensions'
+    signed buckets and the vector is L2-normalized. Texts sharing words get similar vectors, so the
+    whole pipeline (retrieval, caches, thresholds) can run offline and at zero cost in tests and benchmarks. """
+
+    provider_name = "hashing"
+    default_model_name = "hashing-v1"
+    default_dimensions = 384
+
+    def _embed_text(self, text: str) -> list:
+        words = re.findall(r"\w+", text.lower())
+        features = words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+        vector = [0.0] * self.dimensions
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size = 8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector))
+        return [value / norm for value in vector] if norm > 0 else vector
+
+    def _embed_batch(self, texts: list) -> list:
+        return [self._embed_text(text) for text in texts]
+
+EMBEDDING_PROVIDERS = {provider.provider_name: provider
+                       for provider in [OpenAIEmbeddingProvider, LocalEmbeddingProvider, HashingEmbeddingProvider]}
+
+def get_embedding_provider(provider_name: str = None, model_name: str = None, dimensions: int = None, batch_size: int = 64):
+    """ Build the embedding backend. Unset arguments are read from the environment (or '.env'):
+    EMBEDDING_PROVIDER (openai, local, hashing), EMBEDDING_MODEL and EMBEDDING_DIMENSIONS. """
+    provider_name = provider_name or os.getenv("EMBEDDING_PROVIDER", "openai")
+    model_name = model_name or os.getenv("EMBEDDING_MODEL") or None
+    dimensions = dimensions or (int(os.getenv("EMBEDDING_DIMENSIONS")) if os.getenv("EMBEDDING_DIMENSIONS") else None)
+
+    if provider_name not in EMBEDDING_PROVIDERS:
+        raise ValueError(f"Unknown embedding provider '{provider_name}'. Use one among {list(EMBEDDING_PROVIDERS)} please.")
+    return EMBEDDING_PROVIDERS[provider_name](model_name = model_name, dimensions = dimensions, batch_size = batch_size)
@@ -8,11 +8,13 @@ from st_copy_to_clipboard import st_copy_to_clipboard
 st.set_page_config(page_title = "My RAG app", page_icon = "🤖", layout = "wide")
 st.title("🤖 Chat with your PDFs")
 
-from backend import backend_setup, document_ingestor, add_documents
+from backend import backend_setup, document_stream, add_document_stream
 qdrant_admin, qdrant_db, financial_assistant_team = backend_setup()
 
 # import also the useful hyperparameters that are needed in the front-end
-from backend import QDRANT_COLLECTION_NAME, CHUNK_SIZE, CHUNK_OVERLAP, USER_NAME, SUBJECT
+from backend import CHUNK_SIZE, CHUNK_OVERLAP, USER_NAME, SUBJECT, HISTORY_PAGE_TURNS
+from checkpoint_store import latest_checkpoint_id, thread_messages
+from telemetry import telemetry
 
 # fundamental components of streamlit
 # st.chat_message("user" / "assistant")
@@ -38,7 +40,7 @@ from backend import QDRANT_COLLECTION_NAME, CHUNK_SIZE, CHUNK_OVERLAP, USER_NAME
 
 # when the app starts, we have to control which documents are already ingested and sync them with the session
 def get_initial_files():
-    if not qdrant_admin.exists_collection(QDRANT_COLLECTION_NAME):
+    if not qdrant_admin.exists_collection():
         return []
     return qdrant_admin.unique_filenames()
 
@@ -67,30 +69,35 @@ with st.sidebar:
         if file_extension not in admissible_extensions:
             st.error(f"🚨 The extension of '{filename}' is not allowed (use only {admissible_extensions})")
         
-        if st.button(f"🧠 Process '{filename}'"): # botton to process the uploaded file
-
-            if filename in st.session_state["uploaded_files"] or qdrant_admin.is_file_in_db(filename = filename):
-                st.warning(f"The file '{filename}' is already in the Knowledge Base!")
-            else:
-                with st.spinner("Processing the file..."):
-                    if not os.path.exists("tmp"):
-                        os.makedirs("tmp")
-                    temp_path = f"tmp/{filename}"
-                    with open(temp_path, "wb") as file:
-                        file.write(uploaded_file.getbuffer())
-                    try:
-                        chunks = document_ingestor(temp_path, chunk_size = CHUNK_SIZE, chunk_overlap = CHUNK_OVERLAP)
-                        if not qdrant_admin.is_file_in_db(filename = filename):
-                            add_documents(qdrant_admin, qdrant_db, chunks)
+        # a file already in the Knowledge Base is updated: only its modified chunks are re-embedded
+        already_ingested = filename in st.session_state["uploaded_files"] or qdrant_admin.is_file_in_db(filename = filename)
+        button_label = f"🔄 Update '{filename}'" if already_ingested else f"🧠 Process '{filename}'"
+
+        if st.button(button_label): # botton to process the uploaded file
+            with st.spinner("Processing the file..."):
+                if not os.path.exists("tmp"):
+                    os.makedirs("tmp")
+                temp_path = f"tmp/{filename}"
+                with open(temp_path, "wb") as file:
+                    file.write(uploaded_file.getbuffer())
+                try:
+                    # pages are streamed to the embedding stage: memory stays bounded even for large files
+                    windows = document_stream(temp_path, chunk_size = CHUNK_SIZE, chunk_overlap = CHUNK_OVERLAP)
+                    stats = add_document_stream(qdrant_admin, qdrant_db, windows, update = already_ingested)
+                    if already_ingested:
+                        st.toast(f"🔄 {stats.chunks} chunks updated, {stats.skipped} unchanged, {stats.deleted} removed")
+                    else:
+                        st.toast(f"⚡ {stats.chunks} chunks in {stats.seconds:.1f}s ({stats.chunks_per_second:.1f} chunks/s)")
+                    if filename not in st.session_state["uploaded_files"]:
                         st.session_state["uploaded_files"].append(filename)
-                        st.success("Document correctly elaborated.")
-                    except Exception as e:
-                        st.error(f"Error reading file: {e}")
-                    finally:
-                        if os.path.exists(temp_path):
-                            os.remove(temp_path)
-                time.sleep(1)
-                st.rerun()
+                    st.success("Document correctly elaborated.")
+                except Exception as e:
+                    st.error(f"Error reading file: {e}")
+                finally:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+            time.sleep(1)
+            st.rerun()
            
     ########## DISPLAY KNOWLEDGE BASE ##########
     if st.session_state["uploaded_files"]:
@@ -147,6 +154,9 @@ with st.sidebar:
         time.sleep(2)
         st.rerun() 
 
+    # per-stage latencies of the last turn (retrieval, LLM calls, tools...)
+    show_timings = st.toggle("⏱️ Show timing breakdown", value = False)
+
 ################################################
 ################ CHAT INTERFACE ################
 ################################################  
@@ -162,22 +172,54 @@ elif "thread_id" not in st.session_state:
 
 config = {"configurable": {"thread_id": st.session_state["thread_id"]}}
 
-# this first step is necessary to reproduce the 'chat effect'
+def get_thread_history(thread_id: str) -> dict:
+    """ Messages of the last 'visible_turns' turns of the thread, read again only when a new checkpoint has been
+    written or more turns are requested (a click in the page reruns the script, but does not change the conversation) """
+    checkpoint_id = latest_checkpoint_id(financial_assistant_team.checkpointer, thread_id)
+    history = st.session_state.get("history")
+    if history is None or history["thread_id"] != thread_id:
+        history = {"thread_id": thread_id, "checkpoint_id": None, "messages": [], "total_turns": 0, "blocks": {},
+                   "visible_turns": HISTORY_PAGE_TURNS, "loaded_turns": 0}
+        st.session_state["history"] = history
+    if checkpoint_id is not None and (checkpoint_id != history["checkpoint_id"] or history["loaded_turns"] != history["visible_turns"]):
+        history["messages"], history["total_turns"] = thread_messages(financial_assistant_team.checkpointer, thread_id,
+                                                                      history["visible_turns"], checkpoint_id)
+        history["checkpoint_id"] = checkpoint_id
+        history["loaded_turns"] = history["visible_turns"]
+    return history
+
+def message_block(history: dict, msg):
+    """ (role, markdown) of a message, formatted once and cached by message id """
+    if msg.id not in history["blocks"]:
+        if isinstance(msg, HumanMessage):
+            block = ("user", msg.content)
+        elif isinstance(msg, ToolMessage):
+            block = ("🧐", f"📄 **Retrieved Documents (via {msg.name}):**\n\n{msg.content}")
+        elif isinstance(msg, AIMessage) and msg.content:
+            block = ("assistant", f"**Final Answer:**\n\n{msg.content}")
+        else:
+            block = None # tool calls of the team leader are not shown
+        history["blocks"][msg.id] = block
+    return history["blocks"][msg.id]
+
+# this first step is necessary to reproduce the 'chat effect': only the last turns are rendered
 try:
-    current_state = financial_assistant_team.get_state(config)
-    if "messages" in current_state.values:
-        for msg in current_state.values["messages"]:
-            if isinstance(msg, HumanMessage):
-                st.chat_message("user").write(msg.content)
-            elif isinstance(msg, ToolMessage):
-                with st.chat_message("🧐"):
-                    st.markdown(f"📄 **Retrieved Documents (via {msg.name}):**\n\n{msg.content}")
-            elif isinstance(msg, AIMessage) and msg.content:
-                chat_msg = st.chat_message("assistant")
-                with chat_msg:
-                    st.markdown(f"**Final Answer:**\n\n{msg.content}")
-                    unique_btn_key = f"copy_btn_{uuid.uuid4().hex[:8]}"
-                    st_copy_to_clipboard(msg.content, before_copy_label = "Copy Message", key = unique_btn_key)
+    history = get_thread_history(st.session_state["thread_id"])
+    if history["total_turns"] > history["visible_turns"]:
+        if st.button(f"⬆️ Load earlier messages ({history['total_turns'] - history['visible_turns']} more turns)"):
+            history["visible_turns"] += HISTORY_PAGE_TURNS
+            st.rerun()
+
+    for msg in history["messages"]:
+        block = message_block(history, msg)
+        if block is None:
+            continue
+        role, markdown = block
+        with st.chat_message(role):
+            st.markdown(markdown)
+            if role == "assistant":
+                # a stable key: the component is reused across reruns instead of being created again
+                st_copy_to_clipboard(msg.content, before_copy_label = "Copy Message", key = f"copy_btn_{msg.id}")
 except Exception:
     pass # No past conversation
 
@@ -195,6 +237,7 @@ if query:
     
     finished_automatically = False
 
+    turn_spans = telemetry.start_turn() # the spans of the nodes and tools of this turn are collected here
     stream_generator = financial_assistant_team.stream(
                             {"messages": [HumanMessage(content = query)]}, 
                             config = config,
@@ -215,7 +258,7 @@ if query:
                     st.markdown(f"📄 **Retrieved Documents (via {msg_chunk.name}):**\n\n{msg_chunk.content}")
             
             elif isinstance(msg_chunk, AIMessage) and msg_chunk.content:
-                if node_name == "Supernotes":
+                if node_name in ("Supernotes", "Router"): # the router answers greetings and off-topic questions itself
                     if final_answer_container is None:
                         chat_msg = st.chat_message("assistant")
                         final_answer_container = chat_msg.empty()
@@ -232,6 +275,11 @@ if query:
                 unique_btn_key = f"copy_btn_{uuid.uuid4().hex[:8]}"
                 st_copy_to_clipboard(full_final_answer, before_copy_label = "Copy Message", key = unique_btn_key)
 
+    if show_timings and turn_spans:
+        with st.sidebar.expander("⏱️ Timing breakdown of the last turn", expanded = True):
+            st.dataframe([{"stage": span["name"], "ms": span["duration_ms"], **span["attributes"]} for span in turn_spans],
+                         hide_index = True, use_container_width = True)
+
 
 
    
@@ -0,0 +1,127 @@
+import time, uuid, random
+from itertools import islice
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from qdrant_client.models import PointStruct
+
+class IngestionStats:
+    """ Summary of an ingestion run, used to report the throughput """
+
+    def __init__(self):
+        self.chunks = 0 # embedded and upserted
+        self.skipped = 0 # already stored and unchanged
+        self.deleted = 0 # removed because no more in the document
+        self.batches = 0
+        self.retries = 0
+        self.seconds = 0.0
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.chunks / self.seconds if self.seconds > 0 else 0.0
+
+    def __repr__(self):
+        return (f"IngestionStats(chunks = {self.chunks}, skipped = {self.skipped}, deleted = {self.deleted}, "
+                f"batches = {self.batches}, retries = {self.retries}, "
+                f"seconds = {self.seconds:.2f}, chunks_per_second = {self.chunks_per_second:.1f})")
+
+class IngestionEngine:
+    """ Embedding and upsert pipeline for LangChain chunks.
+    Chunks are grouped in batches of 'batch_size': at most 'max_in_flight' embedding requests run
+    concurrently, and every embedded batch is upserted to Qdrant by a dedicated worker while the
+    next batches are still being embedded. Each batch is retried with exponential backoff.
+    The points are written with the same payload schema used by QdrantVectorStore. """
+
+    def __init__(self, client, collection_name: str, embedding_model, batch_size: int = 64, max_in_flight: int = 4,
+                 max_retries: int = 5, backoff_seconds: float = 1.0, vector_name: str = "",
+                 content_payload_key: str = "page_content", metadata_payload_key: str = "metadata"):
+        self.client = client
+        self.collection_name = collection_name
+        self.embedding_model = embedding_model
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.vector_name = vector_name
+        self.content_payload_key = content_payload_key
+        self.metadata_payload_key = metadata_payload_key
+
+    @classmethod
+    def from_vector_store(cls, qdrant_db, **kwargs):
+        """ Build the engine on the same collection and embedding model of a QdrantVectorStore """
+        return cls(client = qdrant_db.client,
+                   collection_name = qdrant_db.collection_name,
+                   embedding_model = qdrant_db.embeddings,
+                   vector_name = qdrant_db.vector_name,
+                   content_payload_key = qdrant_db.content_payload_key,
+                   metadata_payload_key = qdrant_db.metadata_payload_key,
+                   **kwargs)
+
+    def _with_retry(self, stats: IngestionStats, function, *args):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return function(*args)
+            except Exception:
+                if attempt == self.max_retries:
+                    raise
+                stats.retries += 1
+                # exponential backoff with jitter, to not hit the rate limit all together
+                time.sleep(self.backoff_seconds * (2 ** attempt) * (1 + random.random()))
+
+    def _embed_batch(self, stats: IngestionStats, batch: list) -> list:
+        return self._with_retry(stats, self.embedding_model.embed_documents, [chunk.page_content for chunk in batch])
+
+    def _upsert_batch(self, stats: IngestionStats, batch: list, ids: list, vectors: list, on_batch_upserted = None):
+        points = [PointStruct(id = point_id,
+                              vector = {self.vector_name: vector},
+                              payload = {self.content_payload_key: chunk.page_content,
+                                         self.metadata_payload_key: chunk.metadata})
+                  for chunk, point_id, vector in zip(batch, ids, vectors)]
+        self._with_retry(stats, self.client.upsert, self.collection_name, points)
+        if on_batch_upserted is not None:
+            on_batch_upserted(batch)
+
+    def ingest(self, chunks, id_function = None) -> IngestionStats:
+        """ Embed and upsert 'chunks' (any iterable, consumed lazily batch by batch).
+        'id_function(chunk)' gives the point id of a chunk, by default a random uuid. """
+        if id_function is None:
+            id_function = lambda chunk: str(uuid.uuid4())
+        return self.ingest_with_ids((id_function(chunk), chunk) for chunk in chunks)
+
+    def ingest_with_ids(self, pairs, stats: IngestionStats = None, on_batch_upserted = None) -> IngestionStats:
+        """ Same as 'ingest', with an iterable of (point id, chunk) pairs. Since the iterable is consumed
+        only when there is room in the pipeline, a generator keeps the memory bounded.
+        'on_batch_upserted(chunks)' is called (from the upsert worker) after every batch is written. """
+        if stats is None:
+            stats = IngestionStats()
+        start = time.perf_counter()
+        pairs = iter(pairs)
+        embedding_futures = deque()
+        upsert_futures = deque()
+
+        def send_to_upsert(upsert_pool, batch, ids, future):
+            upsert_futures.append(upsert_pool.submit(self._upsert_batch, stats, batch, ids, future.result(), on_batch_upserted))
+            # bound the number of embedded batches waiting to be written
+            while len(upsert_futures) > self.max_in_flight:
+                upsert_futures.popleft().result()
+
+        with ThreadPoolExecutor(max_workers = self.max_in_flight) as embedding_pool, \
+             ThreadPoolExecutor(max_workers = 1) as upsert_pool:
+            while True:
+                batch_pairs = list(islice(pairs, self.batch_size))
+                if not batch_pairs:
+                    break
+                ids = [point_id for point_id, _ in batch_pairs]
+                batch = [chunk for _, chunk in batch_pairs]
+                embedding_futures.append((batch, ids, embedding_pool.submit(self._embed_batch, stats, batch)))
+                stats.chunks += len(batch)
+                stats.batches += 1
+                if len(embedding_futures) >= self.max_in_flight:
+                    send_to_upsert(upsert_pool, *embedding_futures.popleft())
+
+            while embedding_futures:
+                send_to_upsert(upsert_pool, *embedding_futures.popleft())
+            while upsert_futures:
+                upsert_futures.popleft().result()
+
+        stats.seconds += time.perf_counter() - start
+        return stats
@@ -1,13 +1,29 @@
 from langchain_core.prompts import PromptTemplate, ChatPromptTemplate, FewShotPromptTemplate, MessagesPlaceholder
 from langchain_core.output_parsers import StrOutputParser, JsonOutputParser, CommaSeparatedListOutputParser
 from langchain_community.tools import DuckDuckGoSearchRun
-from langchain_core.tools import tool
+from langchain_core.tools import tool, StructuredTool
+from concurrent.futures import ThreadPoolExecutor
+import asyncio, contextvars
 from qdrant_admin import QdrantAdmin
+from telemetry import telemetry, LLMTelemetryCallback
 
 # can not use a class: the use of @ tool would require the llm to generate a parameter 'self'.
 # it is better to use a factory function
 
-def get_my_tools(llm, retriever, subject: str):
+TOOL_MODES = ["answer", "context"]
+# returned by 'search_internal_database' without any LLM call when no chunk passes the score threshold
+NO_RELEVANT_DATA = "NO_RELEVANT_DATA: the internal database has no document relevant to this query."
+
+def get_my_tools(llm, retriever, subject: str, answer_cache = None, speculative_web_threshold = None, mode: str = "answer",
+                 context_assembler = None):
+    """ In 'answer' mode the tools write their own answer with an inner LLM call (RAG_chain / WEB_chain),
+    that the team leader then rewrites. In 'context' mode they skip the inner call and return compact,
+    citation-tagged context straight to the team leader: one generation per question instead of two.
+    With 'speculative_web_threshold' set, 'search_internal_database' starts the web search in parallel
+    with the retrieval: if no retrieved chunk reaches that similarity score, it answers from the web
+    results directly, removing the sequential fallback hop to 'search_internet_duckduckgo'.
+    With a 'context_assembler' (see 'context_assembly.py') the overlapping chunks of a page are stitched
+    together and the redundant ones dropped before the context is formatted. """
     RAG_template = f"""
     You are an expert in {subject} and related topics. Your goal is to provide a highly technical response to the following query:
     ---
@@ -27,7 +43,7 @@ def get_my_tools(llm, retriever, subject: str):
     FINAL ANSWER:
     """
     RAG_prompt = PromptTemplate(template = RAG_template, input_variables = ["query", "formatted_answer"])
-    RAG_chain = RAG_prompt | llm | StrOutputParser()
+    RAG_chain = (RAG_prompt | llm | StrOutputParser()).with_config(callbacks = [LLMTelemetryCallback(telemetry, "rag_chain")])
 
     WEB_template = f"""
     You are an expert in {subject} and related topics. Your goal is to provide a highly technical response to the following query:
@@ -46,32 +62,173 @@ def get_my_tools(llm, retriever, subject: str):
     FINAL ANSWER:
     """
     WEB_prompt = PromptTemplate(template = WEB_template, input_variables = ["query", "web_results"])
-    WEB_chain = WEB_prompt | llm | StrOutputParser()
+    WEB_chain = (WEB_prompt | llm | StrOutputParser()).with_config(callbacks = [LLMTelemetryCallback(telemetry, "web_chain")])
     duckduckgo_search_tool = DuckDuckGoSearchRun()
 
-    @tool
-    def search_internal_database(query: str) -> str: 
-        """ ALWAYS use this tool first for economics questions. 
-            Fundamental tool to perform Retrieval Augmented Generation (RAG) on provided documents. """
-        retrieved_docs = retriever.invoke(query)
-        if not retrieved_docs:
-            return "No useful documents found."
-        
+    if mode not in TOOL_MODES:
+        raise ValueError(f"Unknown tool mode '{mode}'. Use one among {TOOL_MODES} please.")
+
+    def format_compact_context(retrieved_docs: list) -> str:
+        formatted_context = []
+        for i, doc in enumerate(retrieved_docs, start = 1):
+            page = doc.metadata.get("page", "N/A")
+            filename = doc.metadata.get("clean_filename", "Unknown")
+            text = " ".join(doc.page_content.split()) # no layout whitespace, it only costs tokens
+            formatted_context.append(f"[{i}] {filename}, p. {page}: {text}")
+        return "\n".join(formatted_context)
+
+    def format_context(retrieved_docs: list) -> str:
         formatted_answer = []
         for doc in retrieved_docs:
             page = doc.metadata.get("page", "N/A")
             filename = doc.metadata.get("clean_filename", "Unknown")
             text = doc.page_content
-            formatted_answer.append(f"--- FROM FILE: {filename} (Pag: {page}) ---\n{text}")
+            # the similarity lets the model weigh a strong hit against a marginal one
+            score = f", Similarity: {doc.metadata['_score']:.2f}" if "_score" in doc.metadata else ""
+            formatted_answer.append(f"--- FROM FILE: {filename} (Pag: {page}{score}) ---\n{text}")
+        return "\n\n".join(formatted_answer)
+
+    def assemble_context(retrieved_docs: list) -> list:
+        if context_assembler is None:
+            return retrieved_docs
+        with telemetry.span("context_assembly", chunks = len(retrieved_docs)) as span:
+            assembled_docs = context_assembler.assemble(retrieved_docs)
+            span["spans"] = len(assembled_docs)
+        return assembled_docs
 
-        context_string = "\n\n".join(formatted_answer)
-        return RAG_chain.invoke({"query": query, "formatted_answer": context_string})
+    def answer_from_documents(query: str, retrieved_docs: list) -> str:
+        retrieved_docs = assemble_context(retrieved_docs)
+        if mode == "context":
+            return format_compact_context(retrieved_docs)
+        with telemetry.span("rag_chain", chunks = len(retrieved_docs)):
+            return RAG_chain.invoke({"query": query, "formatted_answer": format_context(retrieved_docs)})
 
-    @tool
+    async def aanswer_from_documents(query: str, retrieved_docs: list) -> str:
+        retrieved_docs = assemble_context(retrieved_docs) # pure Python on a few chunks, no need of a thread
+        if mode == "context":
+            return format_compact_context(retrieved_docs)
+        with telemetry.span("rag_chain", chunks = len(retrieved_docs)):
+            return await RAG_chain.ainvoke({"query": query, "formatted_answer": format_context(retrieved_docs)})
+
+    def answer_from_web(query: str, web_results: str) -> str:
+        if mode == "context":
+            return web_results
+        with telemetry.span("web_chain"):
+            return WEB_chain.invoke({"query": query, "web_results": web_results})
+
+    async def aanswer_from_web(query: str, web_results: str) -> str:
+        if mode == "context":
+            return web_results
+        with telemetry.span("web_chain"):
+            return await WEB_chain.ainvoke({"query": query, "web_results": web_results})
+
+    def web_search(query: str) -> str:
+        with telemetry.span("web_search"):
+            return duckduckgo_search_tool.invoke(query)
+
+    async def aweb_search(query: str) -> str:
+        with telemetry.span("web_search"):
+            return await duckduckgo_search_tool.ainvoke(query)
+
+    # every tool has a sync and an async version: the graph uses the second one when run with 'ainvoke'/'astream'
+
+    def is_weak_retrieval(retrieved_docs: list) -> bool:
+        best_score = max((doc.metadata.get("_score", 0.0) for doc in retrieved_docs), default = 0.0)
+        return best_score < speculative_web_threshold
+
+    WEB_FALLBACK_PREFIX = "The internal database has no relevant documents, answer based on a web search:\n\n"
+    speculation_pool = ThreadPoolExecutor(max_workers = 4) if speculative_web_threshold is not None else None
+
+    @telemetry.traced("search_internal_database")
+    def search_internal_database(query: str) -> str: 
+        """ ALWAYS use this tool first for economics questions. 
+            Fundamental tool to perform Retrieval Augmented Generation (RAG) on provided documents. """
+        if answer_cache is not None:
+            cache_version, cached_answer = answer_cache.lookup(query)
+            if cached_answer is not None:
+                return cached_answer
+
+        # the context is copied, so the span of the speculative search is part of the current turn
+        web_future = speculation_pool.submit(contextvars.copy_context().run, web_search, query) if speculation_pool else None
+        with telemetry.span("retrieval") as span:
+            retrieved_docs = retriever.invoke(query)
+            span["chunks"] = len(retrieved_docs)
+
+        answer = None
+        if web_future is not None and is_weak_retrieval(retrieved_docs):
+            try:
+                answer = WEB_FALLBACK_PREFIX + answer_from_web(query, web_future.result())
+            except Exception: # the web search failed, keep the internal path
+                answer = None
+        elif web_future is not None:
+            web_future.cancel() # if already running, its result is discarded
+
+        if answer is None:
+            if not retrieved_docs:
+                return NO_RELEVANT_DATA
+            answer = answer_from_documents(query, retrieved_docs)
+        if answer_cache is not None:
+            answer_cache.store(query, answer, cache_version)
+        return answer
+
+    @telemetry.traced("search_internal_database")
+    async def asearch_internal_database(query: str) -> str:
+        if answer_cache is not None:
+            cache_version, cached_answer = await answer_cache.alookup(query)
+            if cached_answer is not None:
+                return cached_answer
+
+        web_task = asyncio.create_task(aweb_search(query)) if speculative_web_threshold is not None else None
+        with telemetry.span("retrieval") as span:
+            retrieved_docs = await retriever.ainvoke(query)
+            span["chunks"] = len(retrieved_docs)
+
+        answer = None
+        if web_task is not None and is_weak_retrieval(retrieved_docs):
+            try:
+                answer = WEB_FALLBACK_PREFIX + await aanswer_from_web(query, await web_task)
+            except Exception: # the web search failed, keep the internal path
+                answer = None
+        elif web_task is not None:
+            web_task.cancel()
+
+        if answer is None:
+            if not retrieved_docs:
+                return NO_RELEVANT_DATA
+            answer = await aanswer_from_documents(query, retrieved_docs)
+        if answer_cache is not None:
+            await answer_cache.astore(query, answer, cache_version)
+        return answer
+
+    @telemetry.traced("search_internet_duckduckgo")
     def search_internet_duckduckgo(query: str) -> str:
         """ Use this tool ONLY if the 'search_internal_database' fails or the quality of the answer is low.
             This tool enables web search for accurate answers. """
-        web_results = duckduckgo_search_tool.invoke(query)
-        return WEB_chain.invoke({"query": query, "web_results": web_results})
+        web_results = web_search(query)
+        return answer_from_web(query, web_results)
+
+    @telemetry.traced("search_internet_duckduckgo")
+    async def asearch_internet_duckduckgo(query: str) -> str:
+        web_results = await aweb_search(query)
+        return await aanswer_from_web(query, web_results)
+
+    search_internal_database = StructuredTool.from_function(func = search_internal_database, coroutine = asearch_internal_database)
+    search_internet_duckduckgo = StructuredTool.from_function(func = search_internet_duckduckgo, coroutine = asearch_internet_duckduckgo)
+
+    return [search_internal_database, search_internet_duckduckgo]
+
+
+def get_memory_tool(user_memory, user_name: str):
+    """ Tool of the team leader to save a lasting preference of the user in the long-term memory """
+
+    def save_user_preference(preference: str) -> str:
+        """ Save a lasting preference of the user (es answer language, level of detail, style, topics of interest),
+            written as a short self-contained sentence. It is recalled in the following conversations. """
+        user_memory.remember(user_name, preference)
+        return f"Preference saved: {preference}"
+
+    async def asave_user_preference(preference: str) -> str:
+        await user_memory.aremember(user_name, preference)
+        return f"Preference saved: {preference}"
 
-    return [search_internal_database, search_internet_duckduckgo]
\ No newline at end of file
+    return StructuredTool.from_function(func = save_user_preference, coroutine = asave_user_preference)
@@ -1,18 +1,89 @@
-import os
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, Filter, FieldCondition, MatchValue
+import os, time, uuid, hashlib, asyncio
+from datetime import datetime, timezone
+from qdrant_client import QdrantClient, AsyncQdrantClient
+from qdrant_client.models import Distance, VectorParams, Filter, FieldCondition, MatchValue, PointStruct, PayloadSchemaType
+from qdrant_client.models import HnswConfigDiff, ScalarQuantization, ScalarQuantizationConfig, ScalarType
+from qdrant_client.models import BinaryQuantization, BinaryQuantizationConfig, SearchParams, QuantizationSearchParams
+
+MANIFEST_SUFFIX = "_manifest"
+MIGRATION_SUFFIX = "__migration"
+SCROLL_BATCH_SIZE = 1000
+VERSION_POINT_ID = str(uuid.uuid5(uuid.NAMESPACE_OID, "collection_version")) # never collides with a file entry
+VERSION_REFRESH_SECONDS = 5.0 # how often other processes' changes to the collection are noticed
+DEFAULT_PAYLOAD_INDEXES = {"metadata.clean_filename": PayloadSchemaType.KEYWORD,
+                           "metadata.file_type": PayloadSchemaType.KEYWORD,
+                           "metadata.page": PayloadSchemaType.KEYWORD} # a string: "unknown" for TXT and DOCX
+
+class CollectionLayout:
+    """ Storage layout of a collection: vector quantization ('scalar' int8, 'binary' or None),
+    original vectors on disk, HNSW parameters and payload indexes.
+    With quantization, the search runs on the compressed vectors kept in RAM and the best
+    'oversampling' x k candidates are rescored with the original vectors. """
+
+    def __init__(self, quantization = None, on_disk: bool = False, hnsw_m: int = 16, hnsw_ef_construct: int = 100,
+                 payload_indexes: dict = None, rescore: bool = True, oversampling: float = 2.0):
+        if quantization not in (None, "scalar", "binary"):
+            raise ValueError(f"Unknown quantization '{quantization}'. Use one among [None, 'scalar', 'binary'] please.")
+        self.quantization = quantization
+        self.on_disk = on_disk
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construct = hnsw_ef_construct
+        self.payload_indexes = DEFAULT_PAYLOAD_INDEXES if payload_indexes is None else payload_indexes
+        self.rescore = rescore
+        self.oversampling = oversampling
+
+    def quantization_config(self):
+        if self.quantization == "scalar":
+            return ScalarQuantization(scalar = ScalarQuantizationConfig(type = ScalarType.INT8, quantile = 0.99, always_ram = True))
+        if self.quantization == "binary":
+            return BinaryQuantization(binary = BinaryQuantizationConfig(always_ram = True))
+        return None
+
+    def vectors_config(self, vector_size: int) -> VectorParams:
+        return VectorParams(size = vector_size,
+                            distance = Distance.COSINE,
+                            on_disk = self.on_disk,
+                            hnsw_config = HnswConfigDiff(m = self.hnsw_m, ef_construct = self.hnsw_ef_construct),
+                            quantization_config = self.quantization_config())
+
+    def search_params(self):
+        """ Search parameters to be used by the retriever on a collection with this layout """
+        if self.quantization is None:
+            return None
+        return SearchParams(quantization = QuantizationSearchParams(rescore = self.rescore, oversampling = self.oversampling))
+
+# 'default' is the plain float32 in-RAM layout, the others trade some recall for (much) less RAM
+LAYOUT_PROFILES = {
+    "default": CollectionLayout(),
+    "scalar": CollectionLayout(quantization = "scalar", on_disk = True),
+    "binary": CollectionLayout(quantization = "binary", on_disk = True, oversampling = 3.0),
+}
 
 class QdrantAdmin:
     """ Class to manage the connection with Qdrant and the operations on the database.
     Since there are parameters that are specific to the format of the metadata generated 
     by LangChain loaders, we ensure a uniform schema across different file types 
-    (PDF, TXT, DOCX) through a normalization process. """
+    (PDF, TXT, DOCX) through a normalization process. 
+    For every collection, a small side collection (the 'manifest') keeps one point per ingested file,
+    with its number of chunks, a content hash and the ingestion time: existence checks and listings
+    read the manifest, so they do not depend on the number of points of the main collection. """
 
-    def __init__(self, url: str, collection_name: str, vector_size: int):
-        self.client = QdrantClient(url = url) 
+    def __init__(self, url: str, collection_name: str, vector_size: int, layout: CollectionLayout = None):
+        self.url = url
+        self.client = QdrantClient(location = url) # a server url, or ":memory:" for a local in-process Qdrant
+        self._async_client = None
         self.collection_name = collection_name
         self.vector_size = vector_size
+        self.layout = layout if layout is not None else LAYOUT_PROFILES["default"]
+        self._versions = {} # collection_name -> (version, time of the last read)
     
+    @property
+    def async_client(self):
+        """ AsyncQdrantClient on the same server, created at the first use (None for a local Qdrant) """
+        if self._async_client is None and self.url.startswith(("http://", "https://")):
+            self._async_client = AsyncQdrantClient(url = self.url)
+        return self._async_client
+
     def exists_collection(self, collection_name = None) -> bool:
         if not collection_name:
             collection_name = self.collection_name
@@ -23,28 +94,116 @@ class QdrantAdmin:
             collection_name = self.collection_name
         if self.exists_collection(collection_name):
             self.client.delete_collection(collection_name)
+        if self.exists_collection(self.manifest_name(collection_name)):
+            self.client.delete_collection(self.manifest_name(collection_name))
 
-    def create_collection(self, collection_name = None, vector_size = None):
+    def create_collection(self, collection_name = None, vector_size = None, layout: CollectionLayout = None):
         """ Function to create a specific collection if it does not already exist """
         if not collection_name:
             collection_name = self.collection_name
+        self._create_collection_with_layout(collection_name, vector_size, layout)
+        self.ensure_manifest(collection_name)
+
+    def _create_collection_with_layout(self, collection_name: str, vector_size = None, layout: CollectionLayout = None):
         if not vector_size:
             vector_size = self.vector_size
+        if layout is None:
+            layout = self.layout
 
         if not self.exists_collection(collection_name):
             self.client.create_collection(
                 collection_name = collection_name,
-                vectors_config = VectorParams(size = vector_size, 
-                                              distance = Distance.COSINE)
+                vectors_config = layout.vectors_config(vector_size)
             )
+        else:
+            # vectors of another embedding model can not be searched (nor stored) in this collection
+            stored_size = self.client.get_collection(collection_name).config.params.vectors.size
+            if stored_size != vector_size:
+                raise ValueError(f"The collection '{collection_name}' stores vectors of size {stored_size}, but the embedding "
+                                 f"model produces vectors of size {vector_size}. Use another collection or re-ingest the documents.")
+        # payload indexes are needed to delete (and filter) the chunks of a file without a full scan, idempotent
+        for field_name, field_schema in layout.payload_indexes.items():
+            self.client.create_payload_index(
+                collection_name = collection_name,
+                field_name = field_name,
+                field_schema = field_schema)
+
+    @staticmethod
+    def _page_as_keyword(payload: dict) -> dict:
+        """ Payload with 'metadata.page' as a string, the type of its index (older points stored PDF pages as numbers) """
+        metadata = (payload or {}).get("metadata")
+        if isinstance(metadata, dict) and "page" in metadata and not isinstance(metadata["page"], str):
+            return {**payload, "metadata": {**metadata, "page": str(metadata["page"])}}
+        return payload
+
+    def normalize_pages(self, collection_name = None) -> int:
+        """ Rewrite as strings the numeric 'metadata.page' of the points ingested before the page became a
+        KEYWORD index (they are not found by a page filter), returns the number of points updated.
+        It scans the whole collection: run it once after the upgrade ('migrate_collection' does it while copying). """
+        if not collection_name:
+            collection_name = self.collection_name
+        updated = 0
+        pages = {} # new page -> ids of the points, one 'set_payload' per page and scroll batch
+        for point in self.iter_points(collection_name, with_payload = ["metadata.page"]):
+            page = ((point.payload or {}).get("metadata") or {}).get("page")
+            if page is not None and not isinstance(page, str):
+                pages.setdefault(str(page), []).append(point.id)
+            if sum(len(ids) for ids in pages.values()) >= SCROLL_BATCH_SIZE:
+                updated += self._set_pages(collection_name, pages)
+                pages = {}
+        return updated + self._set_pages(collection_name, pages)
+
+    def _set_pages(self, collection_name: str, pages: dict) -> int:
+        for page, ids in pages.items():
+            self.client.set_payload(collection_name = collection_name, payload = {"page": page}, points = ids, key = "metadata")
+        return sum(len(ids) for ids in pages.values())
+
+    def _copy_points(self, source_collection: str, target_collection: str):
+        batch = []
+        for point in self.iter_points(source_collection, with_vectors = True):
+            batch.append(PointStruct(id = point.id, vector = point.vector, payload = self._page_as_keyword(point.payload)))
+            if len(batch) == SCROLL_BATCH_SIZE:
+                self.client.upsert(collection_name = target_collection, points = batch)
+                batch = []
+        if batch:
+            self.client.upsert(collection_name = target_collection, points = batch)
+
+    def migrate_collection(self, layout: CollectionLayout, collection_name = None):
+        """ Rebuild an existing collection with a new layout, keeping its name, points and manifest.
+        The points are first copied in a temporary collection, then the original one is recreated
+        with the new layout and filled back. The collection is not available during the migration.
+        An interrupted migration is resumed by calling it again: once the original collection has been
+        deleted, the temporary one is the only full copy and the refill starts from it. """
+        if not collection_name:
+            collection_name = self.collection_name
+        temp_collection = f"{collection_name}{MIGRATION_SUFFIX}"
+
+        if self.exists_collection(temp_collection) and (not self.exists_collection(collection_name)
+                or self.num_total_points(collection_name) < self.num_total_points(temp_collection)):
+            # a previous run stopped after deleting the original collection (or while filling it back)
+            vector_size = self.client.get_collection(temp_collection).config.params.vectors.size
+        else:
+            vector_size = self.client.get_collection(collection_name).config.params.vectors.size
+            if self.exists_collection(temp_collection): # a previous run stopped while copying: the original is complete
+                self.client.delete_collection(temp_collection)
+            self._create_collection_with_layout(temp_collection, vector_size, layout)
+            self._copy_points(collection_name, temp_collection)
+
+        if self.exists_collection(collection_name):
+            self.client.delete_collection(collection_name)
+        self._create_collection_with_layout(collection_name, vector_size, layout)
+        self._copy_points(temp_collection, collection_name)
+        self.client.delete_collection(temp_collection)
+        if collection_name == self.collection_name:
+            self.layout = layout
     
     def chunks_normalization(self, chunks):
         """ This function is needed to create uniform metadatas for all the types of documents """
         for chunk in chunks:
             original_source = chunk.metadata.get("source", "unknown")
             chunk.metadata["clean_filename"] = os.path.basename(original_source) # from ./...txt to ...txt
-            if "page" not in chunk.metadata:
-                chunk.metadata["page"] = "unknown"
+            # always a string, the type of the payload index: PDF pages are numbers, the other files have none
+            chunk.metadata["page"] = str(chunk.metadata.get("page", "unknown"))
                 
             if original_source.endswith(".pdf"):
                 chunk.metadata["file_type"] = "pdf"
@@ -55,6 +214,19 @@ class QdrantAdmin:
         
         return chunks
 
+    @staticmethod
+    def point_id_generator():
+        """ Return a function chunk -> deterministic point id, derived from (filename, page, chunk hash).
+        Chunks must be passed in document order: identical chunks on the same page are told apart
+        by their occurrence number. The same file always gets the same ids, so re-ingestions can be diffed. """
+        occurrences = {}
+        def point_id(chunk) -> str:
+            key = f"{chunk.metadata['clean_filename']}|{chunk.metadata['page']}|{QdrantAdmin.text_hash(chunk.page_content)}"
+            occurrence = occurrences.get(key, 0)
+            occurrences[key] = occurrence + 1
+            return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{key}|{occurrence}"))
+        return point_id
+
     def num_total_points(self, collection_name = None):
         if not collection_name:
             collection_name = self.collection_name
@@ -71,33 +243,200 @@ class QdrantAdmin:
             with_vectors = False)
         
         return records
+
+    def iter_points(self, collection_name = None, scroll_filter = None, with_payload = True, with_vectors = False):
+        """ Generator over ALL the points of a collection, following the scroll pagination """
+        if not collection_name:
+            collection_name = self.collection_name
+        offset = None
+        while True:
+            records, offset = self.client.scroll(
+                collection_name = collection_name,
+                scroll_filter = scroll_filter,
+                limit = SCROLL_BATCH_SIZE,
+                offset = offset,
+                with_payload = with_payload,
+                with_vectors = with_vectors)
+            yield from records
+            if offset is None:
+                break
+
+    def point_ids_of_file(self, filename: str, collection_name = None) -> set:
+        """ Ids of all the chunks of a file (filtered scroll on the indexed 'metadata.clean_filename') """
+        if not collection_name:
+            collection_name = self.collection_name
+        file_filter = Filter(must = [FieldCondition(key = "metadata.clean_filename", match = MatchValue(value = filename))])
+        return {str(point.id) for point in self.iter_points(collection_name, scroll_filter = file_filter, with_payload = False)}
+
+    def delete_points(self, point_ids, collection_name = None):
+        if not collection_name:
+            collection_name = self.collection_name
+        point_ids = list(point_ids)
+        for i in range(0, len(point_ids), SCROLL_BATCH_SIZE):
+            self.client.delete(collection_name = collection_name, points_selector = point_ids[i:i + SCROLL_BATCH_SIZE])
+
+    ##########################################
+    ################ MANIFEST ################
+    ##########################################
+
+    def manifest_name(self, collection_name = None) -> str:
+        if not collection_name:
+            collection_name = self.collection_name
+        return f"{collection_name}{MANIFEST_SUFFIX}"
+
+    @staticmethod
+    def manifest_point_id(filename: str) -> str:
+        # one point per file: the id is derived from the filename, so lookups are O(1)
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, filename))
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def combine_hashes(chunk_hashes) -> str:
+        return hashlib.sha256("".join(sorted(chunk_hashes)).encode("utf-8")).hexdigest()
+
+    @classmethod
+    def content_hash(cls, texts) -> str:
+        """ Order-independent hash of the chunk texts of a file (it can be rebuilt from a scroll) """
+        return cls.combine_hashes(cls.text_hash(text) for text in texts)
+
+    def ensure_manifest(self, collection_name = None):
+        """ Create the manifest of a collection if missing. For collections created before the
+        manifest existed, it is rebuilt once with a full (paginated) scan """
+        if not collection_name:
+            collection_name = self.collection_name
+        manifest_name = self.manifest_name(collection_name)
+        if self.exists_collection(manifest_name):
+            return
+        self.client.create_collection(collection_name = manifest_name, vectors_config = {})
+        if self.exists_collection(collection_name) and self.num_total_points(collection_name) > 0:
+            self.rebuild_manifest(collection_name)
+
+    def _read_version(self, collection_name: str) -> int:
+        records = self.client.retrieve(collection_name = self.manifest_name(collection_name),
+                                       ids = [VERSION_POINT_ID],
+                                       with_payload = True)
+        return records[0].payload["version"] if records else 0
+
+    async def _aread_version(self, collection_name: str) -> int:
+        async_client = self.async_client
+        if async_client is None: # local mode (es ':memory:'), the data live only in the sync client
+            return await asyncio.to_thread(self._read_version, collection_name)
+        records = await async_client.retrieve(collection_name = self.manifest_name(collection_name),
+                                              ids = [VERSION_POINT_ID],
+                                              with_payload = True)
+        return records[0].payload["version"] if records else 0
+
+    def bump_version(self, collection_name = None) -> int:
+        """ Increase the version of a collection: called at every change of its documents,
+        it invalidates all the caches built on top of the collection.
+        The version is the time of the change in ns: it keeps increasing even if the collection
+        is deleted and created again, and concurrent writers do not need to read it first. """
+        if not collection_name:
+            collection_name = self.collection_name
+        version = max(time.time_ns(), self._versions.get(collection_name, (0, 0.0))[0] + 1)
+        self.client.upsert(
+            collection_name = self.manifest_name(collection_name),
+            points = [PointStruct(id = VERSION_POINT_ID, vector = {}, payload = {"version": version})])
+        self._versions[collection_name] = (version, time.monotonic())
+        return version
+
+    def collection_version(self, collection_name = None) -> int:
+        """ Version of a collection. Changes made by this process are seen immediately,
+        the ones made by other processes (es the bulk ingestion) after VERSION_REFRESH_SECONDS """
+        if not collection_name:
+            collection_name = self.collection_name
+        version, read_at = self._versions.get(collection_name, (None, 0.0))
+        if version is None or time.monotonic() - read_at > VERSION_REFRESH_SECONDS:
+            version = self._read_version(collection_name)
+            self._versions[collection_name] = (version, time.monotonic())
+        return version
+
+    async def acollection_version(self, collection_name = None) -> int:
+        """ Async twin of 'collection_version': the read of the version does not block the event loop """
+        if not collection_name:
+            collection_name = self.collection_name
+        version, read_at = self._versions.get(collection_name, (None, 0.0))
+        if version is None or time.monotonic() - read_at > VERSION_REFRESH_SECONDS:
+            version = await self._aread_version(collection_name)
+            self._versions[collection_name] = (version, time.monotonic())
+        return version
+
+    def rebuild_manifest(self, collection_name = None):
+        if not collection_name:
+            collection_name = self.collection_name
+        texts_per_file = {}
+        for point in self.iter_points(collection_name):
+            payload = point.payload or {}
+            metadata = payload.get("metadata") or {}
+            if "clean_filename" in metadata:
+                texts_per_file.setdefault(metadata["clean_filename"], []).append(payload.get("page_content", ""))
+
+        self.client.delete_collection(self.manifest_name(collection_name))
+        self.client.create_collection(collection_name = self.manifest_name(collection_name), vectors_config = {})
+        for filename, texts in texts_per_file.items():
+            self.register_file(filename, len(texts), self.content_hash(texts), collection_name)
+
+    def register_file(self, filename: str, chunk_count: int, content_hash: str, collection_name = None):
+        if not collection_name:
+            collection_name = self.collection_name
+        self.client.upsert(
+            collection_name = self.manifest_name(collection_name),
+            points = [PointStruct(
+                id = self.manifest_point_id(filename),
+                vector = {},
+                payload = {
+                    "filename": filename,
+                    "chunk_count": chunk_count,
+                    "content_hash": content_hash,
+                    "ingested_at": datetime.now(timezone.utc).isoformat()})])
+        self.bump_version(collection_name)
+
+    def unregister_file(self, filename: str, collection_name = None):
+        if not collection_name:
+            collection_name = self.collection_name
+        self.client.delete(
+            collection_name = self.manifest_name(collection_name),
+            points_selector = [self.manifest_point_id(filename)])
+        self.bump_version(collection_name)
+
+    def file_entry(self, filename: str, collection_name = None):
+        """ Manifest entry of a file (dict with filename, chunk_count, content_hash, ingested_at) or None """
+        if not collection_name:
+            collection_name = self.collection_name
+        records = self.client.retrieve(
+            collection_name = self.manifest_name(collection_name),
+            ids = [self.manifest_point_id(filename)],
+            with_payload = True)
+        return records[0].payload if records else None
+
+    def manifest(self, collection_name = None) -> list:
+        """ List of the manifest entries, one per ingested file """
+        if not collection_name:
+            collection_name = self.collection_name
+        return [record.payload for record in self.iter_points(self.manifest_name(collection_name))
+                if "filename" in record.payload]
     
     def unique_filenames(self, collection_name = None) -> list:
         if not collection_name:
             collection_name = self.collection_name
-        records = self.list_of_points_with_payload(collection_name)
-        filenames = [
-            p.payload["metadata"]["clean_filename"] 
-            for p in records 
-            if p.payload and "metadata" in p.payload and "clean_filename" in p.payload["metadata"]
-        ]
-        unique_filenames = list(set(filenames))
-
-        return unique_filenames
+        return [entry["filename"] for entry in self.manifest(collection_name)]
     
     def is_file_in_db(self, filename: str, collection_name = None) -> bool:
         if not collection_name:
             collection_name = self.collection_name
-        return filename in self.unique_filenames(collection_name)
+        return self.file_entry(filename, collection_name) is not None
 
     def collection_info(self, collection_name = None):
         if not collection_name:
             collection_name = self.collection_name
         print(f"Total number of points:\n\n{self.num_total_points(collection_name)}\n\n")
-        unique_names = self.unique_filenames(collection_name)
-        print(f"There are {len(unique_names)} documents ingested, with titles:\n\n")
-        for unique_name in unique_names:
-            print(unique_name)
+        entries = self.manifest(collection_name)
+        print(f"There are {len(entries)} documents ingested, with titles:\n\n")
+        for entry in entries:
+            print(f"{entry['filename']} ({entry['chunk_count']} chunks, ingested at {entry['ingested_at']})")
         print(f"General info: \n\n{self.client.get_collection(collection_name)}\n\n")
 
     def remove_a_file(self, filename: str, collection_name = None):
@@ -115,4 +454,4 @@ class QdrantAdmin:
                     ],
                 )
             )
-  
\ No newline at end of file
+            self.unregister_file(filename, collection_name)
@@ -0,0 +1,139 @@
+import os, re, math, time
+from abc import ABC, abstractmethod
+from collections import Counter
+
+class Reranker(ABC):
+    """ Second stage of the retrieval: rescoring of a wider candidate set returned by Qdrant.
+    Candidates are scored in batches of at most 'batch_size', in the order of the vector search.
+    When 'budget_seconds' is exhausted the remaining candidates are not scored: they keep their
+    vector order after the scored ones, so a slow CPU never delays the answer by more than one batch. """
+
+    reranker_name = None
+
+    def __init__(self, batch_size: int = 16, budget_seconds: float = None):
+        self.batch_size = batch_size
+        self.budget_seconds = budget_seconds
+
+    @abstractmethod
+    def _score_batch(self, query: str, texts: list, statistics) -> list:
+        """ Scores of a batch of at most 'batch_size' texts (higher is more relevant) """
+
+    def _prepare(self, query: str, texts: list):
+        """ Hook called once per query with all the candidates (es corpus statistics), its result is
+        passed to '_score_batch'. Nothing is kept on the instance: the sessions rerank concurrently. """
+        return None
+
+    def _combine(self, scores: list, docs: list) -> list:
+        """ Hook to mix the new scores with the retrieval ones, the new scores alone by default """
+        return scores
+
+    def score(self, query: str, texts: list) -> list:
+        """ Scores of the texts (None for the ones left out by the latency budget) """
+        start = time.perf_counter()
+        statistics = self._prepare(query, texts)
+        scores = [None] * len(texts)
+        for i in range(0, len(texts), self.batch_size):
+            if i > 0 and self.budget_seconds is not None and time.perf_counter() - start > self.budget_seconds:
+                break
+            scores[i:i + self.batch_size] = self._score_batch(query, texts[i:i + self.batch_size], statistics)
+        return scores
+
+    def rerank(self, query: str, docs: list, top_n: int) -> list:
+        """ The 'top_n' best documents, with their score in the metadata ('_rerank_score') """
+        if len(docs) <= 1:
+            return docs[:top_n]
+        scores = self._combine(self.score(query, [doc.page_content for doc in docs]), docs)
+        ranked = sorted(range(len(docs)), key = lambda i: (scores[i] is None, -(scores[i] or 0.0), i))
+        reranked = []
+        for i in ranked[:top_n]:
+            doc = docs[i]
+            if scores[i] is not None:
+                doc.metadata["_rerank_score"] = float(scores[i])
+            reranked.append(doc)
+        return reranked
+
+class BM25Reranker(Reranker):
+    """ Okapi BM25 of the query against the candidates (the statistics come from the candidate set itself),
+    blended with the cosine similarity of the vector search ('vector_weight'), both min-max normalized:
+    the exact terms of the query (names, formulas, acronyms) break the ties of the embeddings.
+    Pure Python, well under a millisecond for 20 chunks. """
+
+    reranker_name = "bm25"
+    WORD_PATTERN = re.compile(r"\w+")
+
+    def __init__(self, batch_size: int = 16, budget_seconds: float = None, k1: float = 1.5, b: float = 0.75,
+                 vector_weight: float = 0.5):
+        super().__init__(batch_size, budget_seconds)
+        self.k1 = k1
+        self.b = b
+        self.vector_weight = vector_weight
+
+    def _words(self, text: str) -> list:
+        return self.WORD_PATTERN.findall(text.lower())
+
+    def _prepare(self, query: str, texts: list):
+        """ (idf of the query words, mean length) over the candidates """
+        documents = [self._words(text) for text in texts]
+        mean_length = sum(len(words) for words in documents) / max(len(documents), 1) or 1.0
+        documents = [set(words) for words in documents]
+        idf = {}
+        for word in set(self._words(query)):
+            frequency = sum(word in document for document in documents)
+            idf[word] = math.log(1 + (len(texts) - frequency + 0.5) / (frequency + 0.5))
+        return idf, mean_length
+
+    def _score_batch(self, query: str, texts: list, statistics) -> list:
+        idf_of_words, mean_length = statistics
+        scores = []
+        for text in texts:
+            words = self._words(text)
+            counts = Counter(words)
+            normalization = self.k1 * (1 - self.b + self.b * len(words) / mean_length)
+            scores.append(sum(idf * counts[word] * (self.k1 + 1) / (counts[word] + normalization)
+                              for word, idf in idf_of_words.items() if counts[word]))
+        return scores
+
+    @staticmethod
+    def _normalize(values: list) -> list:
+        known = [value for value in values if value is not None]
+        low, high = (min(known), max(known)) if known else (0.0, 0.0)
+        return [None if value is None else (value - low) / (high - low) if high > low else 0.0 for value in values]
+
+    def _combine(self, scores: list, docs: list) -> list:
+        lexical = self._normalize(scores)
+        vector = self._normalize([doc.metadata.get("_score") for doc in docs])
+        return [None if lexical_score is None else
+                (1 - self.vector_weight) * lexical_score + self.vector_weight * (vector_score or 0.0)
+                for lexical_score, vector_score in zip(lexical, vector)]
+
+class CrossEncoderReranker(Reranker):
+    """ Small cross-encoder on CPU (query and chunk read together: more precise than the bi-encoder
+    of the vector search). It requires 'pip install sentence-transformers'. """
+
+    reranker_name = "cross-encoder"
+    default_model_name = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+    def __init__(self, batch_size: int = 16, budget_seconds: float = None, model_name: str = None):
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError as e:
+            raise ImportError("The 'cross-encoder' reranker requires: pip install sentence-transformers") from e
+        super().__init__(batch_size, budget_seconds)
+        self.model_name = model_name or self.default_model_name
+        self.model = CrossEncoder(self.model_name, device = "cpu")
+
+    def _score_batch(self, query: str, texts: list, statistics) -> list:
+        scores = self.model.predict([(query, text) for text in texts], batch_size = self.batch_size,
+                                    show_progress_bar = False, convert_to_numpy = True)
+        return scores.tolist()
+
+RERANKERS = {reranker.reranker_name: reranker for reranker in [BM25Reranker, CrossEncoderReranker]}
+
+def get_reranker(reranker_name: str = None, batch_size: int = 16, budget_seconds: float = None):
+    """ Build the reranker, None for "none". An unset name is read from the environment: RERANKER (bm25, cross-encoder, none) """
+    reranker_name = reranker_name or os.getenv("RERANKER", "bm25")
+    if reranker_name == "none":
+        return None
+    if reranker_name not in RERANKERS:
+        raise ValueError(f"Unknown reranker '{reranker_name}'. Use one among {list(RERANKERS) + ['none']} please.")
+    return RERANKERS[reranker_name](batch_size = batch_size, budget_seconds = budget_seconds)
@@ -0,0 +1,95 @@
+import asyncio
+from typing import Any
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from telemetry import telemetry
+
+class QdrantRetriever(BaseRetriever):
+    """ Similarity retriever on the collection managed by a QdrantAdmin.
+    The documents are rebuilt from the payload schema of QdrantVectorStore, so it reads the points
+    written by the ingestion. Unlike 'QdrantVectorStore.as_retriever', the async path is truly
+    async: the query is embedded with the async embedding client and searched with AsyncQdrantClient.
+    With a 'reranker' (see 'reranker.py') the search fetches 'fetch_k' candidates, cheap to get from
+    Qdrant, and only the best 'k' after the rescoring are returned.
+    The points below 'score_threshold' are cut by Qdrant itself, and with 'relative_score_cutoff' the
+    number of chunks adapts to the scores: only those within that fraction of the best one are kept
+    (at least 'min_k'), so a single strong hit is not diluted by noise. An empty result means that
+    nothing relevant is in the collection. """
+
+    qdrant_admin: Any
+    embedding_model: Any
+    k: int = 4
+    reranker: Any = None
+    fetch_k: int = 20
+    score_threshold: Any = None
+    relative_score_cutoff: Any = None
+    min_k: int = 1
+    search_params: Any = None
+    query_filter: Any = None
+    vector_name: str = ""
+    content_payload_key: str = "page_content"
+    metadata_payload_key: str = "metadata"
+
+    @property
+    def search_kwargs(self) -> dict:
+        return {"k": self.k, "filter": self.query_filter, "search_params": self.search_params,
+                "score_threshold": self.score_threshold}
+
+    def _query_kwargs(self, query_vector: list) -> dict:
+        return {"collection_name": self.qdrant_admin.collection_name,
+                "query": query_vector,
+                "using": self.vector_name or None,
+                "query_filter": self.query_filter,
+                "search_params": self.search_params,
+                "score_threshold": self.score_threshold,
+                "limit": self.fetch_k if self.reranker is not None else self.k,
+                "with_payload": True,
+                "with_vectors": False}
+
+    def _to_documents(self, points: list) -> list:
+        documents = []
+        for point in points:
+            metadata = dict(point.payload.get(self.metadata_payload_key) or {})
+            metadata["_id"] = point.id
+            metadata["_collection_name"] = self.qdrant_admin.collection_name
+            metadata["_score"] = point.score # cosine similarity with the query
+            documents.append(Document(page_content = point.payload.get(self.content_payload_key, ""), metadata = metadata))
+        return documents
+
+    def _adaptive_cut(self, documents: list) -> list:
+        """ Chunks whose similarity is at least 'relative_score_cutoff' times the best one (sorted by Qdrant) """
+        if self.relative_score_cutoff is not None and documents and documents[0].metadata["_score"] > 0:
+            cutoff = documents[0].metadata["_score"] * self.relative_score_cutoff
+            kept = [doc for doc in documents if doc.metadata["_score"] >= cutoff]
+            documents = kept if len(kept) >= self.min_k else documents[:self.min_k]
+        telemetry.observe("retrieved_chunks", len(documents))
+        return documents
+
+    def _select(self, query: str, documents: list) -> list:
+        """ Adaptive cut on the similarity, then rescoring of the remaining candidates """
+        documents = self._adaptive_cut(documents)
+        if self.reranker is None or not documents:
+            return documents
+        with telemetry.span("rerank", candidates = len(documents)):
+            return self.reranker.rerank(query, documents, top_n = self.k)
+
+    def _get_relevant_documents(self, query: str, *, run_manager) -> list:
+        with telemetry.span("embed_query"):
+            query_vector = self.embedding_model.embed_query(query)
+        with telemetry.span("qdrant_search"):
+            points = self.qdrant_admin.client.query_points(**self._query_kwargs(query_vector)).points
+        return self._select(query, self._to_documents(points))
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager) -> list:
+        with telemetry.span("embed_query"):
+            query_vector = await self.embedding_model.aembed_query(query)
+        async_client = self.qdrant_admin.async_client
+        with telemetry.span("qdrant_search"):
+            if async_client is None: # local mode (es ':memory:'), the data live only in the sync client
+                points = (await asyncio.to_thread(self.qdrant_admin.client.query_points, **self._query_kwargs(query_vector))).points
+            else:
+                points = (await async_client.query_points(**self._query_kwargs(query_vector))).points
+        if self.reranker is None:
+            return self._adaptive_cut(self._to_documents(points))
+        # the rescoring is CPU bound: it runs in a worker thread, not in the event loop
+        return await asyncio.to_thread(self._select, query, self._to_documents(points))
@@ -0,0 +1,83 @@
+import threading, asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+from pydantic import PrivateAttr
+from langchain_core.retrievers import BaseRetriever
+from telemetry import telemetry
+
+class CachedRetriever(BaseRetriever):
+    """ In-process LRU cache in front of a retriever: (normalized query, k, filter) -> retrieved documents.
+    A hit skips both the query embedding and the Qdrant search. The cache is tagged with the version
+    of the collection ('version_getter()'), so it is emptied as soon as documents are added or removed.
+    The async path reads the version with 'aversion_getter' (in a worker thread without it). """
+
+    retriever: BaseRetriever
+    version_getter: Callable[[], Any]
+    aversion_getter: Optional[Callable[[], Awaitable[Any]]] = None
+    max_entries: int = 256
+
+    _cache: OrderedDict = PrivateAttr(default_factory = OrderedDict)
+    _version: Any = PrivateAttr(default = None)
+    _lock: Any = PrivateAttr(default_factory = threading.Lock)
+    _hits: int = PrivateAttr(default = 0)
+    _misses: int = PrivateAttr(default = 0)
+
+    @property
+    def search_kwargs(self) -> dict:
+        return getattr(self.retriever, "search_kwargs", {})
+
+    def _key(self, query: str) -> tuple:
+        search_kwargs = self.search_kwargs
+        return (" ".join(query.lower().split()), search_kwargs.get("k"), repr(search_kwargs.get("filter")))
+
+    async def _aversion(self):
+        if self.aversion_getter is not None:
+            return await self.aversion_getter()
+        return await asyncio.to_thread(self.version_getter)
+
+    def _lookup(self, key: tuple, version):
+        # the version is read by the caller, outside the lock: it may need a round trip to Qdrant
+        with self._lock:
+            if version != self._version:
+                self._cache.clear()
+                self._version = version
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self._hits += 1
+                telemetry.cache_result("retrieval", hit = True)
+                # copies: the callers can not modify the cached documents
+                return version, [doc.model_copy(deep = True) for doc in self._cache[key]]
+            self._misses += 1
+            telemetry.cache_result("retrieval", hit = False)
+            return version, None
+
+    def _store(self, key: tuple, version, docs: list):
+        with self._lock:
+            if version != self._version: # the collection changed during the search
+                return
+            self._cache[key] = [doc.model_copy(deep = True) for doc in docs]
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last = False)
+
+    def stats(self) -> dict:
+        total = self._hits + self._misses
+        return {"hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / total if total else 0.0,
+                "entries": len(self._cache)}
+
+    def _get_relevant_documents(self, query: str, *, run_manager) -> list:
+        key = self._key(query)
+        version, docs = self._lookup(key, self.version_getter())
+        if docs is None:
+            docs = self.retriever.invoke(query, config = {"callbacks": run_manager.get_child()})
+            self._store(key, version, docs)
+        return docs
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager) -> list:
+        key = self._key(query)
+        version, docs = self._lookup(key, await self._aversion())
+        if docs is None:
+            docs = await self.retriever.ainvoke(query, config = {"callbacks": run_manager.get_child()})
+            self._store(key, version, docs)
+        return docs
@@ -0,0 +1,127 @@
+import re, threading
+import numpy as np
+
+ROUTES = ["greeting", "refuse", "retrieve", "slow"]
+
+# a greeting is a message made only of these expressions (plus punctuation and names): anything else is a question
+GREETING_EXPRESSIONS = {
+    "en": ["hi", "hello", "hey", "good (morning|afternoon|evening|night)", "thanks?( you)?( so much| a lot| very much)?",
+           "thx", "ok(ay)?", "great", "perfect", "nice", "cool", "awesome", "bye", "goodbye", "see you( soon)?",
+           "have a (nice|great|good) day"],
+    "it": ["ciao", "salve", "buongiorno", "buonasera", "buonanotte", "grazie( mille| tante)?", "ok", "ottimo", "perfetto",
+           "va bene", "arrivederci", "a presto", "buona giornata"],
+}
+GREETING_PATTERNS = {language: re.compile(r"(?:(?:" + "|".join(expressions) + r")\b\s*)+")
+                     for language, expressions in GREETING_EXPRESSIONS.items()}
+# frequent function words, enough to pick the language of a templated refusal
+LANGUAGE_WORDS = {
+    "en": {"the", "a", "an", "of", "to", "and", "is", "are", "what", "how", "can", "you", "for", "in", "me", "my", "do",
+           "which", "who", "where", "when", "tomorrow", "today", "with", "best", "should"},
+    "it": {"il", "lo", "la", "gli", "le", "un", "una", "di", "del", "della", "che", "e", "è", "per", "con", "come",
+           "cosa", "quale", "chi", "dove", "quando", "mi", "puoi", "domani", "oggi", "non", "sono", "migliore", "dovrei"},
+}
+MIN_LANGUAGE_WORDS = 2 # fewer function words (es "in Berlin") do not tell the language
+
+OUT_OF_DOMAIN_EXAMPLES = ["a cooking recipe for dinner", "the result of the football match", "the weather forecast for tomorrow",
+                          "a movie or tv series to watch", "planning a holiday trip", "celebrity gossip and news",
+                          "fashion and clothes shopping", "song lyrics and music charts"]
+
+class QueryRouter:
+    """ Local classifier of the user message, run before the team leader:
+    - "greeting": messages made only of greetings and thanks (and names), answered with a template;
+    - "refuse": questions much closer to the out-of-domain examples than to the subject, refused with a template
+      in their language (when it is not recognised, the team leader answers instead);
+    - "retrieve": questions much closer to the subject, sent straight to 'search_internal_database';
+    - "slow": everything else (follow-ups, preferences, ambiguous questions) goes to the team leader LLM.
+    The subject and the off-topic examples are embedded once; a message costs one query embedding,
+    which the embedding cache then serves again to the retrieval. The margins are conservative on
+    purpose: a wrong shortcut costs more than the LLM hop it saves. """
+
+    def __init__(self, embedding_model, domain_examples: list, out_of_domain_examples: list = None,
+                 retrieve_margin: float = 0.15, refuse_margin: float = 0.2, min_words: int = 5, names: list = None):
+        self.embedding_model = embedding_model
+        self.domain_examples = domain_examples
+        self.out_of_domain_examples = out_of_domain_examples or OUT_OF_DOMAIN_EXAMPLES
+        self.retrieve_margin = retrieve_margin
+        self.refuse_margin = refuse_margin
+        self.min_words = min_words # shorter messages (es "and the second one?") usually depend on the history
+        self.names = {name.lower() for name in (names or [])} # allowed in a greeting, es "thanks Supernotes!"
+        self._prototypes = None
+        self._lock = threading.Lock()
+
+    def greeting_language(self, text: str):
+        """ Language of a greeting/thanks message, None if the message is not one """
+        words = [word for word in re.findall(r"\w+", text.lower()) if word not in self.names]
+        if not words:
+            return None
+        for language, pattern in GREETING_PATTERNS.items():
+            if pattern.fullmatch(" ".join(words)):
+                return language
+        return None
+
+    def message_language(self, text: str):
+        """ Language of a message ("en", "it"), None when it can not be told """
+        greeting_language = self.greeting_language(text)
+        if greeting_language is not None:
+            return greeting_language
+        words = re.findall(r"\w+", text.lower())
+        hits = {language: sum(word in function_words for word in words) for language, function_words in LANGUAGE_WORDS.items()}
+        ranked = sorted(hits.items(), key = lambda item: item[1], reverse = True)
+        if ranked[0][1] < MIN_LANGUAGE_WORDS or ranked[0][1] == ranked[1][1]:
+            return None
+        return ranked[0][0]
+
+    def _checked(self, text: str, decision: tuple) -> tuple:
+        # a refusal is a template: it is only used when the language of the message is known
+        route, margin = decision
+        if route == "refuse" and self.message_language(text) is None:
+            return "slow", margin
+        return decision
+
+    @staticmethod
+    def _normalize(vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype = np.float32)
+        return vectors / (np.linalg.norm(vectors, axis = -1, keepdims = True) + 1e-12)
+
+    def _load_prototypes(self, domain_vectors: list, out_of_domain_vectors: list):
+        with self._lock:
+            if self._prototypes is None:
+                self._prototypes = (self._normalize(domain_vectors), self._normalize(out_of_domain_vectors))
+        return self._prototypes
+
+    def _decide(self, query_vector: list) -> tuple:
+        domain, out_of_domain = self._prototypes
+        query_vector = self._normalize(query_vector)
+        margin = float((domain @ query_vector).max() - (out_of_domain @ query_vector).max())
+        if margin >= self.retrieve_margin:
+            return "retrieve", margin
+        if margin <= -self.refuse_margin:
+            return "refuse", margin
+        return "slow", margin
+
+    def _shortcut(self, text: str):
+        """ Route decided without embeddings, None if the classifier is needed """
+        if self.greeting_language(text) is not None:
+            return "greeting", None
+        if len(text.split()) < self.min_words:
+            return "slow", None
+        return None
+
+    def route(self, text: str) -> tuple:
+        """ (route, margin between subject and off-topic similarity) """
+        shortcut = self._shortcut(text)
+        if shortcut is not None:
+            return shortcut
+        if self._prototypes is None:
+            self._load_prototypes(self.embedding_model.embed_documents(self.domain_examples),
+                                  self.embedding_model.embed_documents(self.out_of_domain_examples))
+        return self._checked(text, self._decide(self.embedding_model.embed_query(text)))
+
+    async def aroute(self, text: str) -> tuple:
+        shortcut = self._shortcut(text)
+        if shortcut is not None:
+            return shortcut
+        if self._prototypes is None:
+            self._load_prototypes(await self.embedding_model.aembed_documents(self.domain_examples),
+                                  await self.embedding_model.aembed_documents(self.out_of_domain_examples))
+        return self._checked(text, self._decide(await self.embedding_model.aembed_query(text)))
@@ -0,0 +1,70 @@
+import time, uuid, threading
+from typing import Annotated
+from langgraph.graph import MessagesState
+from langchain_core.messages import ToolMessage
+
+def merge_token_counts(left: dict, right: dict) -> dict:
+    """ Reducer of the 'token_counts' channel: the counts returned by a node are added to the stored ones """
+    if not right:
+        return left or {}
+    return {**(left or {}), **right}
+
+class SupernotesState(MessagesState):
+    """ MessagesState with the token count of every message (by message id), saved in the checkpoints
+    together with the messages, the seconds spent building the short-term memory in the last turn and,
+    in summary mode (see 'summary_memory.py'), the running summary with the id of the last message folded in it """
+    token_counts: Annotated[dict, merge_token_counts]
+    trim_seconds: float
+    summary: str
+    summarized_until: str
+
+class ShortMemory:
+    """ Window of the most recent messages that fits in 'max_tokens' (same result as
+    trim_messages(strategy = "last") without partial messages).
+    Each message is tokenized once: its count is cached in the state under the message id, so a turn
+    only tokenizes the new messages and walks back from the tail until the budget is exhausted,
+    instead of re-tokenizing the whole thread. """
+
+    def __init__(self, token_counter, max_tokens: int):
+        self.token_counter = token_counter # a chat model (get_num_tokens_from_messages) or a callable on a list of messages
+        self.max_tokens = max_tokens
+        self.turns = 0
+        self.total_seconds = 0.0
+        self.last_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def count(self, message) -> int:
+        if hasattr(self.token_counter, "get_num_tokens_from_messages"):
+            return self.token_counter.get_num_tokens_from_messages([message])
+        return self.token_counter([message])
+
+    def window(self, messages: list, token_counts: dict):
+        """ (recent messages within the budget, counts of the messages tokenized now, seconds spent) """
+        start = time.perf_counter()
+        new_counts, kept, used = {}, [], 0
+        for message in reversed(messages):
+            if message.id is None:
+                message.id = str(uuid.uuid4())
+            tokens = token_counts.get(message.id)
+            if tokens is None:
+                tokens = new_counts[message.id] = self.count(message)
+            if used + tokens > self.max_tokens:
+                break
+            used += tokens
+            kept.append(message)
+        kept.reverse()
+        # the window must not start with tool outputs, whose tool calls were cut out
+        while kept and isinstance(kept[0], ToolMessage):
+            kept.pop(0)
+
+        seconds = time.perf_counter() - start
+        with self._lock:
+            self.turns += 1
+            self.total_seconds += seconds
+            self.last_seconds = seconds
+        return kept, new_counts, seconds
+
+    def stats(self) -> dict:
+        return {"turns": self.turns,
+                "last_trim_seconds": self.last_seconds,
+                "mean_trim_seconds": self.total_seconds / self.turns if self.turns else 0.0}
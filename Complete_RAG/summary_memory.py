@@ -0,0 +1,103 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
+from short_memory import ShortMemory
+from telemetry import telemetry, LLMTelemetryCallback
+
+SUMMARY_TEMPLATE = """You keep the running summary of a conversation between {user_name} and Supernotes, an assistant for {subject}.
+Update the summary with the new messages below. Keep what can matter later: the questions of {user_name},
+the key facts of the answers with their sources (document and page, or url), decisions and open points.
+Write at most {max_words} words, in the language of the conversation. Reply with the summary only.
+
+CURRENT SUMMARY:
+{summary}
+
+NEW MESSAGES:
+{messages}"""
+TOOL_OUTPUT_CHARS = 1500 # a tool output is summarized from its beginning only
+
+class SummaryMemory:
+    """ Short-term memory made of a running summary plus a small window of recent messages.
+    The messages that leave the 'recent_memory' window are folded into the summary by a background
+    worker, off the critical path of the turn: the result is collected by the next turn of the same
+    thread and saved in the state ('summary', 'summarized_until'), so it lives in the checkpoints.
+    Until a message is folded it stays in the prompt as raw text (within the 'window_memory' budget):
+    nothing is lost while the summary catches up. """
+
+    def __init__(self, llm, window_memory: ShortMemory, recent_memory: ShortMemory, user_name: str, subject: str,
+                 max_words: int = 250, max_workers: int = 2):
+        self.llm = llm.with_config(callbacks = [LLMTelemetryCallback(telemetry, "summarizer")])
+        self.window_memory = window_memory
+        self.recent_memory = recent_memory
+        self.user_name = user_name
+        self.subject = subject
+        self.max_words = max_words
+        self.executor = ThreadPoolExecutor(max_workers = max_workers, thread_name_prefix = "summarizer")
+        self._futures = {} # thread_id -> future of (summary, id of the last folded message)
+        self._lock = threading.Lock()
+
+    def _format(self, messages: list) -> str:
+        lines = []
+        for message in messages:
+            content = message.content if isinstance(message.content, str) else str(message.content)
+            if isinstance(message, HumanMessage):
+                lines.append(f"{self.user_name}: {content}")
+            elif isinstance(message, ToolMessage):
+                lines.append(f"Tool '{message.name}': {content[:TOOL_OUTPUT_CHARS]}")
+            elif isinstance(message, AIMessage) and content:
+                lines.append(f"Supernotes: {content}")
+        return "\n".join(lines)
+
+    def summarize(self, summary: str, messages: list) -> tuple:
+        """ (summary updated with 'messages', id of the last of them) """
+        with telemetry.span("summarize", messages = len(messages)):
+            prompt = SUMMARY_TEMPLATE.format(user_name = self.user_name, subject = self.subject, max_words = self.max_words,
+                                             summary = summary or "(empty)", messages = self._format(messages))
+            new_summary = self.llm.invoke(prompt).content
+        return new_summary, messages[-1].id
+
+    def _harvest(self, thread_id: str):
+        with self._lock:
+            future = self._futures.get(thread_id)
+            if future is None or not future.done():
+                return None
+            del self._futures[thread_id]
+        try:
+            return future.result()
+        except Exception as e: # the messages are folded again by the next turn
+            print(f"⚠️ Conversation summary of '{thread_id}' failed: {e}")
+            return None
+
+    def _submit(self, thread_id: str, summary: str, messages: list):
+        with self._lock:
+            if thread_id not in self._futures: # one summarization per thread at a time
+                self._futures[thread_id] = self.executor.submit(self.summarize, summary, messages)
+
+    def prepare(self, thread_id: str, messages: list, token_counts: dict, summary: str = "", summarized_until: str = None):
+        """ (summary, history for the prompt, state update), and schedule the folding of the messages
+        that left the recent window """
+        update = {}
+        finished = self._harvest(thread_id)
+        if finished is not None:
+            summary, summarized_until = finished
+            update.update({"summary": summary, "summarized_until": summarized_until})
+
+        recent, new_counts, seconds = self.recent_memory.window(messages, token_counts) # also sets the missing ids
+        positions = {message.id: i for i, message in enumerate(messages)}
+        recent_start = positions[recent[0].id] if recent else len(messages)
+        if not summarized_until: # nothing folded yet ("": the summary starts before the first message)
+            unsummarized_start = 0
+        elif summarized_until in positions:
+            unsummarized_start = positions[summarized_until] + 1
+        else:
+            # the last folded message is no longer in the state: the summary is kept as it is and
+            # the folding goes on from the recent window, instead of summarizing the whole history again
+            unsummarized_start = recent_start
+            summarized_until = messages[recent_start - 1].id if recent_start > 0 else ""
+            update["summarized_until"] = summarized_until
+        if recent_start > unsummarized_start:
+            self._submit(thread_id, summary, messages[unsummarized_start:recent_start])
+
+        history, window_counts, window_seconds = self.window_memory.window(messages[unsummarized_start:], {**token_counts, **new_counts})
+        update.update({"token_counts": {**new_counts, **window_counts}, "trim_seconds": seconds + window_seconds})
+        return summary or "", history, update
@@ -0,0 +1,192 @@
+import time, json, bisect, asyncio, functools, threading, contextvars
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from langchain_core.callbacks import BaseCallbackHandler
+
+# upper bounds of the histogram buckets: seconds for the latencies, plain numbers for tokens and chunks
+SECONDS_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+COUNT_BUCKETS = [1, 5, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000]
+
+class Histogram:
+    def __init__(self, buckets: list):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # the last one is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+class Telemetry:
+    """ In-process spans, histograms and counters, with two offline exporters: a Prometheus text
+    endpoint ('serve_prometheus') and a JSON-lines file with one record per span ('jsonl_path').
+    The spans of the current turn are also collected in a context variable ('start_turn' / 'turn_spans'),
+    which is inherited by the threads and tasks that LangGraph starts for the nodes and the tools. """
+
+    def __init__(self, jsonl_path: str = None):
+        self.jsonl_path = jsonl_path
+        self.histograms = {} # (name, labels) -> Histogram
+        self.counters = {} # (name, labels) -> value
+        self._lock = threading.Lock()
+        self._turn = contextvars.ContextVar("telemetry_turn", default = None)
+        self._server = None
+
+    @staticmethod
+    def _labels(labels: dict) -> tuple:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def observe(self, name: str, value: float, buckets: list = None, **labels):
+        key = (name, self._labels(labels))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(buckets or (SECONDS_BUCKETS if name.endswith("_seconds") else COUNT_BUCKETS))
+            self.histograms[key].observe(value)
+
+    def increment(self, name: str, value: float = 1, **labels):
+        key = (name, self._labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def cache_result(self, cache: str, hit: bool):
+        self.increment("cache_requests_total", cache = cache, result = "hit" if hit else "miss")
+
+    def start_turn(self) -> list:
+        """ Start collecting the spans of a new turn (to be called before invoking/streaming the graph) """
+        spans = []
+        self._turn.set(spans)
+        return spans
+
+    def turn_spans(self) -> list:
+        return list(self._turn.get() or [])
+
+    def record_span(self, name: str, start: float, seconds: float, attributes: dict = None):
+        self.observe("stage_seconds", seconds, stage = name)
+        record = {"name": name, "start": start, "duration_ms": round(seconds * 1000, 3), "attributes": attributes or {}}
+        spans = self._turn.get()
+        if spans is not None:
+            spans.append(record)
+        if self.jsonl_path:
+            with self._lock, open(self.jsonl_path, "a", encoding = "utf-8") as f:
+                f.write(json.dumps(record, default = str) + "\n")
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """ Time a stage; the yielded dict can be filled with attributes (es chunk counts) inside the block """
+        start_wall, start = time.time(), time.perf_counter()
+        try:
+            yield attributes
+        except Exception as e:
+            attributes["error"] = type(e).__name__
+            raise
+        finally:
+            self.record_span(name, start_wall, time.perf_counter() - start, attributes)
+
+    def traced(self, name: str):
+        """ Decorator: a span around every call of a sync or async function (signature and docstring are kept) """
+        def decorator(function):
+            if asyncio.iscoroutinefunction(function):
+                @functools.wraps(function)
+                async def async_wrapper(*args, **kwargs):
+                    with self.span(name):
+                        return await function(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def prometheus_text(self) -> str:
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"supernotes_{name}{self._format_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ["+Inf"], histogram.counts):
+                    cumulative += count
+                    lines.append(f"supernotes_{name}_bucket{self._format_labels(labels + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"supernotes_{name}_sum{self._format_labels(labels)} {histogram.total}")
+                lines.append(f"supernotes_{name}_count{self._format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _format_labels(labels: tuple) -> str:
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+    def serve_prometheus(self, port: int, host: str = "127.0.0.1"):
+        """ Serve the metrics on http://host:port/metrics from a daemon thread (once per process) """
+        if self._server is not None:
+            return
+        telemetry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = telemetry.prometheus_text().encode("utf-8")
+                self.send_response(200 if self.path.startswith("/metrics") else 404)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        try:
+            self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        except OSError as e: # es another worker process of the app already serves the port
+            print(f"⚠️ Metrics endpoint not started on port {port}: {e}")
+            return
+        threading.Thread(target = self._server.serve_forever, daemon = True).start()
+
+class LLMTelemetryCallback(BaseCallbackHandler):
+    """ Time to first token, total latency and tokens in/out of the LLM calls of a stage
+    (the first token is seen only when the call is streamed, es by 'stream_mode = "messages"') """
+
+    def __init__(self, telemetry: Telemetry, call: str):
+        self.telemetry = telemetry
+        self.call = call
+        self._starts = {} # run_id -> (start time, first token seen)
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        with self._lock:
+            self._starts[run_id] = [time.perf_counter(), False]
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        with self._lock:
+            self._starts[run_id] = [time.perf_counter(), False]
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        with self._lock:
+            state = self._starts.get(run_id)
+            if state is None or state[1]:
+                return
+            state[1] = True
+        self.telemetry.observe("llm_ttft_seconds", time.perf_counter() - state[0], call = self.call)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            state = self._starts.pop(run_id, None)
+        if state is not None:
+            self.telemetry.observe("llm_seconds", time.perf_counter() - state[0], call = self.call)
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    self.telemetry.observe("llm_tokens", usage.get("input_tokens", 0), call = self.call, direction = "in")
+                    self.telemetry.observe("llm_tokens", usage.get("output_tokens", 0), call = self.call, direction = "out")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            self._starts.pop(run_id, None)
+        self.telemetry.increment("llm_errors_total", call = self.call)
+
+# one registry per process, shared by backend, tools and frontend
+telemetry = Telemetry()
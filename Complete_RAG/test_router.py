@@ -0,0 +1,37 @@
+import pytest
+from embeddings import HashingEmbeddingProvider
+from router import QueryRouter
+
+@pytest.fixture
+def router():
+    return QueryRouter(HashingEmbeddingProvider(), ["Physics", "Physics and Mathematics"], names = ["Alessio", "Supernotes"])
+
+@pytest.mark.parametrize("text, language", [("thanks!", "en"),
+                                            ("great, thanks!", "en"),
+                                            ("Hi Supernotes :)", "en"),
+                                            ("thank you so much Alessio", "en"),
+                                            ("Ciao!", "it"),
+                                            ("grazie mille, a presto", "it")])
+def test_greetings_are_recognised(router, text, language):
+    assert router.greeting_language(text) == language
+    assert router.route(text) == ("greeting", None)
+
+@pytest.mark.parametrize("text", ["hi what is beta",
+                                  "ok and the second one?",
+                                  "thanks now explain it",
+                                  "hello, can you explain the Carnot cycle?",
+                                  "history of physics"])
+def test_questions_starting_with_a_greeting_word_are_not_greetings(router, text):
+    assert router.greeting_language(text) is None
+    assert router.route(text)[0] != "greeting"
+
+@pytest.mark.parametrize("text, language", [("what is the best recipe for dinner?", "en"),
+                                            ("qual è la migliore ricetta per la cena?", "it"),
+                                            ("wie wird das Wetter morgen?", None)])
+def test_message_language(router, text, language):
+    assert router.message_language(text) == language
+
+def test_refusal_needs_a_known_language(router, monkeypatch):
+    monkeypatch.setattr(router, "_decide", lambda query_vector: ("refuse", -0.5))
+    assert router.route("qual è la migliore ricetta per la cena?") == ("refuse", -0.5)
+    assert router.route("wie wird das Wetter morgen in Berlin?") == ("slow", -0.5)
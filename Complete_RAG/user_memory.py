@@ -0,0 +1,83 @@
+import time, uuid, sqlite3, asyncio
+import numpy as np
+from langgraph.store.sqlite import SqliteStore
+
+MEMORY_NAMESPACE = "user_memory"
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread = False, isolation_level = None)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA busy_timeout = 5000")
+    return conn
+
+def open_user_store(path: str, embedding_model = None, dimensions: int = None) -> SqliteStore:
+    """ Durable store of the user memories in SQLite, shared by all the processes of the app.
+    With an embedding model, the memories are embedded at write time and searched by meaning with
+    sqlite-vec. Python builds whose sqlite3 can not load extensions get a store without index:
+    'UserMemory' then keeps the vectors in the values and ranks them itself. """
+    if embedding_model is not None:
+        try:
+            store = SqliteStore(_connect(path), index = {"dims": dimensions, "embed": embedding_model, "fields": ["text"]})
+            store.setup()
+            return store
+        except (AttributeError, sqlite3.OperationalError) as e: # no 'enable_load_extension', or sqlite-vec not loadable
+            print(f"⚠️ sqlite-vec is not available ({e}): the user memories are ranked in Python.")
+    store = SqliteStore(_connect(path))
+    store.setup()
+    return store
+
+class UserMemory:
+    """ Long-term memories of a user (preferences, facts about their studies) on a LangGraph store.
+    Every user has a separate namespace, bounded to the 'max_memories' most recently updated ones,
+    so a recall is a single search in a small, indexed namespace.
+    If the store has no vector index, the memories are embedded with 'embedding_model' when saved
+    and the recall ranks the (at most 'max_memories') vectors of the namespace by cosine similarity. """
+
+    def __init__(self, store, embedding_model = None, max_memories: int = 100):
+        self.store = store
+        self.embedding_model = embedding_model if not getattr(store, "index_config", None) else None
+        self.max_memories = max_memories
+
+    @staticmethod
+    def namespace(user_name: str) -> tuple:
+        return (MEMORY_NAMESPACE, user_name)
+
+    def remember(self, user_name: str, text: str, kind: str = "preference") -> str:
+        namespace = self.namespace(user_name)
+        # the same text is stored once, a repetition only refreshes it
+        key = str(uuid.uuid5(uuid.NAMESPACE_OID, " ".join(text.lower().split())))
+        value = {"text": text, "kind": kind, "saved_at": time.time()}
+        if self.embedding_model is not None:
+            value["embedding"] = list(map(float, self.embedding_model.embed_query(text)))
+        self.store.put(namespace, key, value)
+        # the namespace holds at most max_memories + 1 items here ('updated_at' of the store has a 1 s resolution)
+        items = self.store.search(namespace, limit = self.max_memories + 100)
+        items.sort(key = lambda item: item.value.get("saved_at", 0.0), reverse = True)
+        for item in items[self.max_memories:]:
+            self.store.delete(namespace, item.key)
+        return key
+
+    def recall(self, user_name: str, query: str = None, limit: int = 5) -> list:
+        """ Texts of the memories most similar to 'query' (the most recent ones without a query) """
+        namespace = self.namespace(user_name)
+        if not query:
+            return [item.value["text"] for item in self.store.search(namespace, limit = limit)]
+        if self.embedding_model is None:
+            return [item.value["text"] for item in self.store.search(namespace, query = query, limit = limit)]
+
+        query_vector = np.asarray(self.embedding_model.embed_query(query), dtype = np.float32)
+        # vectors of another embedding space (different dimensions) can not be compared with the query
+        items = [item for item in self.store.search(namespace, limit = self.max_memories)
+                 if len(item.value.get("embedding", [])) == len(query_vector)]
+        if not items:
+            return []
+        vectors = np.asarray([item.value["embedding"] for item in items], dtype = np.float32)
+        similarities = (vectors @ query_vector) / (np.linalg.norm(vectors, axis = 1) * np.linalg.norm(query_vector) + 1e-12)
+        return [items[i].value["text"] for i in np.argsort(-similarities)[:limit]]
+
+    async def aremember(self, user_name: str, text: str, kind: str = "preference") -> str:
+        return await asyncio.to_thread(self.remember, user_name, text, kind)
+
+    async def arecall(self, user_name: str, query: str = None, limit: int = 5) -> list:
+        # SqliteStore has no async interface: its (short) queries run in a worker thread
+        return await asyncio.to_thread(self.recall, user_name, query, limit)